@@ -2,6 +2,9 @@ from discord.ext import commands
 import discord
 from cogs.utils.settings import Settings
 from cogs.utils.dataIO import dataIO
+from cogs.utils.lagmonitor import LagMonitor
+from cogs.utils.metrics import Metrics
+from cogs.utils.router import MessageRouter
 from cogs.utils.chat_formatting import inline
 import asyncio
 import os
@@ -23,6 +26,12 @@ bot = commands.Bot(command_prefix=["_"], formatter=formatter,
 
 settings = Settings()
 
+lag_monitor = LagMonitor()
+
+metrics = Metrics()
+
+router = MessageRouter(bot)
+
 from cogs.utils import checks
 
 
@@ -59,10 +68,32 @@ async def on_command(command, ctx):
 
 @bot.event
 async def on_message(message):
-    if user_allowed(message):
+    route = router.route(message, allowed=user_allowed(message))
+    router.dispatch(route)
+    if route.allowed:
         await bot.process_commands(message)
 
 
+@bot.event
+async def on_server_role_create(role):
+    settings.invalidate_server(role.server)
+
+
+@bot.event
+async def on_server_role_delete(role):
+    settings.invalidate_server(role.server)
+
+
+@bot.event
+async def on_server_role_update(before, after):
+    settings.invalidate_server(after.server)
+
+
+@bot.event
+async def on_server_remove(server):
+    settings.invalidate_server(server)
+
+
 @bot.event
 async def on_command_error(error, ctx):
     if isinstance(error, commands.MissingRequiredArgument):
@@ -99,37 +130,10 @@ async def send_cmd_help(ctx):
 
 def user_allowed(message):
 
-    author = message.author
-
     mod = bot.get_cog('Mod')
 
     if mod is not None:
-        if settings.owner == author.id:
-            return True
-        if not message.channel.is_private:
-            server = message.server
-            names = (settings.get_server_admin(
-                server), settings.get_server_mod(server))
-            results = map(
-                lambda name: discord.utils.get(author.roles, name=name), names)
-            for r in results:
-                if r is not None:
-                    return True
-
-        if author.id in mod.blacklist_list:
-            return False
-
-        if mod.whitelist_list:
-            if author.id not in mod.whitelist_list:
-                return False
-
-        if not message.channel.is_private:
-            if message.server.id in mod.ignore_list["SERVERS"]:
-                return False
-
-            if message.channel.id in mod.ignore_list["CHANNELS"]:
-                return False
-        return True
+        return mod.access.allowed(message)
     else:
         return True
 
@@ -152,68 +156,69 @@ def check_folders():
 
 def check_configs():
     if settings.bot_settings == settings.default_settings:
-        print("\nSimbad Bot - First run configuration\n")
-        print("A Discord python bot made by Leavism")
-        print("\nInsert your bot's token:")
-
-        choice = input("> ")
-
-        if "@" not in choice and len(choice) >= 50:  # Assuming token
-            settings.login_type = "token"
-            settings.email = choice
-        elif "@" in choice:
-            settings.login_type = "email"
-            settings.email = choice
-            settings.password = input("\nPassword> ")
-        else:
-            os.remove('data/simbad/settings.json')
-            input("Invalid input. Restart Red and repeat the configuration "
-                  "process.")
-            exit(1)
-
-        print("\nChoose a prefix. A prefix is what you type before a command.\n"
-              "Can be multiple characters. You will be able to change it "
-              "\nChoose your prefix:")
-        confirmation = False
-        while confirmation is False:
-            new_prefix = ensure_reply("\nPrefix> ").strip()
-            print("\nAre you sure you want {0} as your prefix?\nYou "
-                  "will be able to issue commands like this: {0}help"
-                  "\nType yes to confirm or no to change it".format(new_prefix))
-            confirmation = get_answer()
-
-        settings.prefixes = [new_prefix]
-
-        print("\nOnce you're done with the configuration, you will have to type "
-              "'{}set owner' *in Discord's chat*\nto set yourself as owner.\n"
-              "Press enter to continue".format(new_prefix))
-        settings.owner = input("") # Shh, they will never know it's here
-        if settings.owner == "":
-            settings.owner = "id_here"
-        if not settings.owner.isdigit() or len(settings.owner) < 17:
-            if settings.owner != "id_here":
-                print("\nERROR: What you entered is not a valid ID. Set "
-                      "yourself as owner later with {}set owner".format(new_prefix))
-            settings.owner = "id_here"
-
-        print("\nInput the admin role's name. Anyone with this role in Discord will be "
-              "able to use the bot's admin commands")
-        print("Leave blank for default name (Transistor)")
-        settings.default_admin = input("\nAdmin role> ")
-        if settings.default_admin == "":
-            settings.default_admin = "Transistor"
-
-        print("\nInput the moderator role's name. Anyone with this role in Discord will "
-              "be able to use the bot's mod commands")
-        print("Leave blank for default name (Process)")
-        settings.default_mod = input("\nModerator role> ")
-        if settings.default_mod == "":
-            settings.default_mod = "Process"
-
-        print("\nThe configuration is done. Leave this window always open to keep "
-              "Red online.\nAll commands will have to be issued through Discord's "
-              "chat, *this window will now be read only*.\nPress enter to continue")
-        input("\n")
+        with settings.batch(): # Saved once, when it's all done
+            print("\nSimbad Bot - First run configuration\n")
+            print("A Discord python bot made by Leavism")
+            print("\nInsert your bot's token:")
+
+            choice = input("> ")
+
+            if "@" not in choice and len(choice) >= 50:  # Assuming token
+                settings.login_type = "token"
+                settings.email = choice
+            elif "@" in choice:
+                settings.login_type = "email"
+                settings.email = choice
+                settings.password = input("\nPassword> ")
+            else:
+                os.remove('data/simbad/settings.json')
+                input("Invalid input. Restart Red and repeat the configuration "
+                      "process.")
+                exit(1)
+
+            print("\nChoose a prefix. A prefix is what you type before a command.\n"
+                  "Can be multiple characters. You will be able to change it "
+                  "\nChoose your prefix:")
+            confirmation = False
+            while confirmation is False:
+                new_prefix = ensure_reply("\nPrefix> ").strip()
+                print("\nAre you sure you want {0} as your prefix?\nYou "
+                      "will be able to issue commands like this: {0}help"
+                      "\nType yes to confirm or no to change it".format(new_prefix))
+                confirmation = get_answer()
+
+            settings.prefixes = [new_prefix]
+
+            print("\nOnce you're done with the configuration, you will have to type "
+                  "'{}set owner' *in Discord's chat*\nto set yourself as owner.\n"
+                  "Press enter to continue".format(new_prefix))
+            settings.owner = input("") # Shh, they will never know it's here
+            if settings.owner == "":
+                settings.owner = "id_here"
+            if not settings.owner.isdigit() or len(settings.owner) < 17:
+                if settings.owner != "id_here":
+                    print("\nERROR: What you entered is not a valid ID. Set "
+                          "yourself as owner later with {}set owner".format(new_prefix))
+                settings.owner = "id_here"
+
+            print("\nInput the admin role's name. Anyone with this role in Discord will be "
+                  "able to use the bot's admin commands")
+            print("Leave blank for default name (Transistor)")
+            settings.default_admin = input("\nAdmin role> ")
+            if settings.default_admin == "":
+                settings.default_admin = "Transistor"
+
+            print("\nInput the moderator role's name. Anyone with this role in Discord will "
+                  "be able to use the bot's mod commands")
+            print("Leave blank for default name (Process)")
+            settings.default_mod = input("\nModerator role> ")
+            if settings.default_mod == "":
+                settings.default_mod = "Process"
+
+            print("\nThe configuration is done. Leave this window always open to keep "
+                  "Red online.\nAll commands will have to be issued through Discord's "
+                  "chat, *this window will now be read only*.\nPress enter to continue")
+            input("\n")
 
     if not os.path.isfile("data/simbad/cogs.json"):
         print("Creating new cogs.json...")
@@ -338,6 +343,11 @@ def main():
     check_folders()
     check_configs()
     set_logger()
+    dataIO.enable_write_behind(bot.loop)
+    lag_monitor.start(bot.loop, dump_path="data/simbad/lag.json")
+    metrics.attach(bot)
+    metrics.start(bot.loop, path="data/simbad/metrics.prom",
+                  port=settings.bot_settings.get("METRICS_PORT"))
     owner_cog = load_cogs()
     if settings.prefixes != []:
         bot.command_prefix = settings.prefixes
@@ -392,4 +402,5 @@ if __name__ == '__main__':
         logger.error(traceback.format_exc())
         loop.run_until_complete(bot.logout())
     finally:
+        dataIO.flush()
         loop.close()
@@ -0,0 +1,95 @@
+"""user_allowed with 100k blacklisted users: the old list scans against
+the AccessIndex sets.
+
+Run from the bot's folder: python benchmarks/access_index.py"""
+import os
+import sys
+import timeit
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from cogs.utils.access import AccessIndex
+
+BLACKLISTED = 100000
+MESSAGES = 10000
+
+Role = namedtuple("Role", "id name")
+Member = namedtuple("Member", "id roles")
+Server = namedtuple("Server", "id roles")
+Channel = namedtuple("Channel", "id is_private")
+Message = namedtuple("Message", "author server channel")
+View = namedtuple("View", "admin mod exempt_ids")
+
+
+class Settings():
+    """What AccessIndex needs from cogs.utils.settings.Settings"""
+    owner = "1"
+
+    def __init__(self, view):
+        self.view = view
+
+    def server_view(self, server):
+        return self.view
+
+
+def old_user_allowed(message, settings, blacklist, whitelist, ignore_list):
+    """user_allowed before the AccessIndex"""
+    author = message.author
+    if settings.owner == author.id:
+        return True
+    if not message.channel.is_private:
+        names = (settings.view.admin, settings.view.mod)
+        for name in names:
+            for role in author.roles:
+                if role.name == name:
+                    return True
+    if author.id in blacklist:
+        return False
+    if whitelist:
+        if author.id not in whitelist:
+            return False
+    if not message.channel.is_private:
+        if message.server.id in ignore_list["SERVERS"]:
+            return False
+        if message.channel.id in ignore_list["CHANNELS"]:
+            return False
+    return True
+
+
+def main():
+    roles = [Role(str(900 + i), "role{}".format(i)) for i in range(10)]
+    admin = Role("42", "Transistor")
+    server = Server("500", roles + [admin])
+    channel = Channel("600", False)
+    settings = Settings(View("Transistor", "Process", frozenset(["42"])))
+    blacklist = [str(10 ** 17 + i) for i in range(BLACKLISTED)]
+    ignore_list = {"SERVERS": ["7"], "CHANNELS": ["8"]}
+    # Half the authors are blacklisted, none have the admin role
+    messages = []
+    for i in range(MESSAGES):
+        user_id = blacklist[i * 7 % BLACKLISTED] if i % 2 else str(i)
+        messages.append(Message(Member(user_id, roles[:3]), server, channel))
+    index = AccessIndex(settings, blacklist, [], ignore_list["SERVERS"],
+                        ignore_list["CHANNELS"])
+
+    def old():
+        for m in messages:
+            old_user_allowed(m, settings, blacklist, [], ignore_list)
+
+    def new():
+        for m in messages:
+            index.allowed(m)
+
+    new() # Fills the role cache, like the first message of each member
+    assert [index.allowed(m) for m in messages] == \
+        [old_user_allowed(m, settings, blacklist, [], ignore_list)
+         for m in messages]
+    old_time = min(timeit.repeat(old, number=1, repeat=3)) / MESSAGES
+    new_time = min(timeit.repeat(new, number=1, repeat=5)) / MESSAGES
+    print("{} blacklisted ids, {} messages".format(BLACKLISTED, MESSAGES))
+    print("lists:       {:10.2f} us/message".format(old_time * 1e6))
+    print("AccessIndex: {:10.2f} us/message".format(new_time * 1e6))
+
+
+if __name__ == "__main__":
+    main()
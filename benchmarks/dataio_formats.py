@@ -0,0 +1,64 @@
+"""Bytes written and encode/decode time of the dataIO file formats, for a
+profile file with 100k accounts.
+
+Run from the bot's folder: python benchmarks/dataio_formats.py"""
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from cogs.utils.dataIO import DataIO, FORMATS
+
+ACCOUNTS = 100000
+SERVERS = 20
+ROUNDS = 3
+
+
+def make_profiles():
+    rnd = random.Random(42)
+    data = {}
+    for i in range(ACCOUNTS):
+        server = str(100000000000000000 + i % SERVERS)
+        user = str(200000000000000000 + i)
+        data.setdefault(server, {})[user] = {
+            "name": "user{}".format(i), "cmdr": "CMDR {}".format(i),
+            "assets": rnd.randint(0, 10 ** 9), "powerplay": "_____",
+            "superpower": "_____", "fedrank": "None", "emprank": "None",
+            "combat": "_____", "trade": "_____", "explore": "_____",
+            "location": "____", "ships": "None",
+            "created_at": "2016-08-{:02d} 12:00:00".format(i % 28 + 1)}
+    return data
+
+
+def best_of(func):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        func()
+        took = time.perf_counter() - start
+        best = took if best is None else min(best, took)
+    return best
+
+
+def main():
+    data = make_profiles()
+    dataIO = DataIO()
+    folder = tempfile.mkdtemp()
+    print("{} accounts, best of {}\n".format(ACCOUNTS, ROUNDS))
+    print("{:<8} {:>12} {:>10} {:>10}".format("format", "bytes",
+                                             "encode s", "decode s"))
+    for fmt in FORMATS:
+        filename = os.path.join(folder, "profile_{}.json".format(fmt))
+        dataIO.set_format(filename, fmt)
+        encode = best_of(lambda: dataIO._save_json(filename, data))
+        decode = best_of(lambda: dataIO._read_json(filename))
+        print("{:<8} {:>12,} {:>10.3f} {:>10.3f}".format(
+            fmt, os.path.getsize(filename), encode, decode))
+        os.remove(filename)
+    os.rmdir(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
 from discord.ext import commands
 from .utils.chat_formatting import *
-from .utils.dataIO import fileIO
+from .utils.dataIO import fileIO, dataIO
 from .utils import checks
-from __main__ import user_allowed, send_cmd_help
+from __main__ import send_cmd_help, router
 import os
 
 
@@ -10,6 +10,9 @@ class Alias:
     def __init__(self, bot):
         self.bot = bot
         self.aliases = fileIO("data/alias/aliases.json", "load")
+        self.index = {}  # server id : {alias : (expansion, base)}
+        self.command_names = set()  # Lowercase
+        self.refresh_commands()
 
     @commands.group(pass_context=True)
     @checks.mod_or_permissions(administrator=True)
@@ -29,7 +32,7 @@ class Alias:
                                " of the fact that I allow arguments to"
                                " aliases. It sucks, I know, deal with it.")
             return
-        if self.part_of_existing_command(command, server.id):
+        if self.part_of_existing_command(command):
             await self.bot.say('I can\'t safely add an alias that starts with '
                                'an existing command or alias. Sry <3')
             return
@@ -40,7 +43,9 @@ class Alias:
             self.aliases[server.id] = {}
         if command not in self.bot.commands:
             self.aliases[server.id][command] = to_execute
-            fileIO("data/alias/aliases.json", "save", self.aliases)
+            self._index_server(server.id)
+            router.listen(self.check_aliases, server=server.id, command=command)
+            await dataIO.save_json_async("data/alias/aliases.json", self.aliases)
             await self.bot.say("Alias '{}' added.".format(command))
         else:
             await self.bot.say("Cannot add '{}' because it's a real bot "
@@ -50,18 +55,14 @@ class Alias:
     async def _help_alias(self, ctx, command):
         """Tries to execute help for the base command of the alias"""
         server = ctx.message.server
-        if server.id in self.aliases:
-            server_aliases = self.aliases[server.id]
-            if command in server_aliases:
-                help_cmd = server_aliases[command].split(" ")[0]
-                new_content = self.bot.command_prefix[0]
-                new_content += "help "
-                new_content += help_cmd[len(self.get_prefix(help_cmd)):]
-                message = ctx.message
-                message.content = new_content
-                await self.bot.process_commands(message)
-            else:
-                await self.bot.say("That alias doesn't exist.")
+        entry = self.index.get(server.id, {}).get(command)
+        if entry is not None:
+            message = ctx.message
+            message.content = "{}help {}".format(self.bot.command_prefix[0],
+                                                 entry[1])
+            await self.bot.process_commands(message)
+        elif server.id in self.aliases:
+            await self.bot.say("That alias doesn't exist.")
 
     @alias.command(name="show", pass_context=True)
     async def _show_alias(self, ctx, command):
@@ -80,7 +81,13 @@ class Alias:
         server = ctx.message.server
         if server.id in self.aliases:
             self.aliases[server.id].pop(command, None)
-            fileIO("data/alias/aliases.json", "save", self.aliases)
+            self._index_server(server.id)
+            # The router matches words in any case, "Foo" may still need it
+            word = command.lower()
+            if all(a.lower() != word for a in self.index.get(server.id, ())):
+                router.unlisten(self.check_aliases, server=server.id,
+                                command=command)
+            await dataIO.save_json_async("data/alias/aliases.json", self.aliases)
         await self.bot.say("Alias '{}' deleted.".format(command))
 
     @commands.command(pass_context=True)
@@ -97,32 +104,43 @@ class Alias:
                 message += "```"
                 await self.bot.say(message)
 
-    async def check_aliases(self, message):
-        if not user_allowed(message):
+    async def check_aliases(self, route):
+        if not route.allowed or route.own or route.private:
             return
 
-        if message.author.id == self.bot.user.id or \
-                len(message.content) < 2 or message.channel.is_private:
-            return
+        entry = self.index.get(route.server_id, {}).get(route.command)
+        if entry is not None:
+            message = route.message
+            start = len(route.prefix) + len(route.command)
+            message.content = route.prefix + entry[0] + message.content[start:]
+            await self.bot.process_commands(message)
+
+    def route_aliases(self):
+        for sid, aliases in self.aliases.items():
+            self._index_server(sid)
+            for alias in aliases:
+                router.listen(self.check_aliases, server=sid, command=alias)
+
+    def _index_server(self, sid):
+        """Aliases, case sensitive like they always were, with their
+           expansion and the command it starts with"""
+        index = {}
+        for alias, to_execute in self.aliases.get(sid, {}).items():
+            index[alias] = (to_execute, to_execute.split(" ")[0])
+        if index:
+            self.index[sid] = index
+        else:
+            self.index.pop(sid, None)
+
+    def refresh_commands(self):
+        self.command_names = {c.lower() for c in self.bot.commands}
+
+    async def commands_changed(self, cogname=None):
+        self.refresh_commands()
 
-        msg = message.content
-        server = message.server
-        prefix = self.get_prefix(msg)
-
-        if prefix and server.id in self.aliases:
-            if self.first_word(msg[len(prefix):]) in self.aliases[server.id]:
-                alias = self.first_word(msg[len(prefix):])
-                new_command = self.aliases[server.id][alias]
-                args = message.content[len(prefix + alias):]
-                message.content = prefix + new_command + args
-                await self.bot.process_commands(message)
-
-    def part_of_existing_command(self, alias, server):
-        '''Command or alias'''
-        for command in self.bot.commands:
-            if alias.lower() == command.lower():
-                return True
-        return False
+    def part_of_existing_command(self, alias):
+        '''Bot command, any case'''
+        return alias.lower() in self.command_names
 
     def remove_old(self):
         for sid in self.aliases:
@@ -168,5 +186,10 @@ def setup(bot):
     check_file()
     n = Alias(bot)
     n.remove_old()
-    bot.add_listener(n.check_aliases, "on_message")
+    n.route_aliases()
+    bot.add_listener(n.commands_changed, "on_cog_loaded")
+    bot.add_listener(n.commands_changed, "on_cog_unloaded")
+    # Cogs loaded after this one at startup are all in by then
+    bot.add_listener(n.commands_changed, "on_ready")
     bot.add_cog(n)
+    n.refresh_commands() # Alias's own commands are in now
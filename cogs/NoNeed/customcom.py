@@ -2,7 +2,7 @@ import discord
 from discord.ext import commands
 from .utils.dataIO import fileIO
 from .utils import checks
-from __main__ import user_allowed, send_cmd_help
+from __main__ import send_cmd_help, router
 import os
 
 class CustomCommands:
@@ -11,6 +11,9 @@ class CustomCommands:
     def __init__(self, bot):
         self.bot = bot
         self.c_commands = fileIO("data/customcom/commands.json", "load")
+        for sid, cmdlist in self.c_commands.items():
+            for cmd in cmdlist:
+                router.listen(self.checkCC, server=sid, command=cmd)
 
     @commands.command(pass_context=True, no_pm=True)
     @checks.mod_or_permissions(administrator=True)
@@ -32,6 +35,7 @@ class CustomCommands:
             cmdlist[command] = text
             self.c_commands[server.id] = cmdlist
             fileIO("data/customcom/commands.json", "save", self.c_commands)
+            router.listen(self.checkCC, server=server.id, command=command)
             await self.bot.say("Custom command successfully added.")
         else:
             await self.bot.say("This command already exists. Use editcom to edit it.")
@@ -73,6 +77,7 @@ class CustomCommands:
                 cmdlist.pop(command, None)
                 self.c_commands[server.id] = cmdlist
                 fileIO("data/customcom/commands.json", "save", self.c_commands)
+                router.unlisten(self.checkCC, server=server.id, command=command)
                 await self.bot.say("Custom command successfully deleted.")
             else:
                 await self.bot.say("That command doesn't exist.")
@@ -103,31 +108,19 @@ class CustomCommands:
         else:
             await self.bot.say("There are no custom commands in this server. Use addcom [command] [text]")
 
-    async def checkCC(self, message):
-        if message.author.id == self.bot.user.id or len(message.content) < 2 or message.channel.is_private:
+    async def checkCC(self, route):
+        if route.own or route.private or not route.allowed:
             return
 
-        if not user_allowed(message):
-            return
-
-        msg = message.content
-        server = message.server
-        prefix = self.get_prefix(msg)
-
-        if prefix and server.id in self.c_commands.keys():
-            cmdlist = self.c_commands[server.id]
-            cmd = msg[len(prefix):]
+        message = route.message
+        if route.server_id in self.c_commands.keys():
+            cmdlist = self.c_commands[route.server_id]
+            cmd = message.content[len(route.prefix):]
             if cmd in cmdlist.keys():
                 await self.bot.send_message(message.channel, cmdlist[cmd])
             elif cmd.lower() in cmdlist.keys():
                 await self.bot.send_message(message.channel, cmdlist[cmd.lower()])
 
-    def get_prefix(self, msg):
-        for p in self.bot.command_prefix:
-            if msg.startswith(p):
-                return p
-        return False
-
 def check_folders():
     if not os.path.exists("data/customcom"):
         print("Creating data/customcom folder...")
@@ -143,5 +136,4 @@ def setup(bot):
     check_folders()
     check_files()
     n = CustomCommands(bot)
-    bot.add_listener(n.checkCC, "on_message")
     bot.add_cog(n)
@@ -1,10 +1,10 @@
 import discord
 from discord.ext import commands
-from cogs.utils.dataIO import dataIO, fileIO
+from cogs.utils.dataIO import fileIO
+from cogs.utils.sqlstore import KeyedStore, LEGACY
 from collections import namedtuple, defaultdict
 from datetime import datetime
 from random import randint
-from copy import deepcopy
 from cogs.utils import checks
 from __main__ import send_cmd_help
 import os
@@ -43,23 +43,23 @@ class SameSenderAndReceiver(BankError):
 
 class Bank:
     def __init__(self, bot):
-        self.accounts = dataIO.load_json("data/economy/bank.json")
+        self.accounts = KeyedStore("data/economy/bank.db", "bank",
+                                   indexes=("balance",))
+        self.accounts.migrate_json("data/economy/bank.json")
         self.bot = bot
 
     def create_account(self, user):
         server = user.server
         if not self.account_exists(user):
-            if server.id not in self.accounts:
-                self.accounts[server.id] = {}
-            if user.id in self.accounts: # Legacy account
-                balance = self.accounts[user.id]["balance"]
+            legacy = self.accounts.get(LEGACY, user.id)
+            if legacy is not None: # Legacy account
+                balance = legacy["balance"]
             else:
                 balance = 0
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             account = {"name" : user.name, "balance" : balance,
             "created_at" : timestamp}
-            self.accounts[server.id][user.id] = account
-            self._save_bank()
+            self.accounts.set(server.id, user.id, account)
             return self.get_account(user)
         else:
             raise AccountAlreadyExists
@@ -72,36 +72,29 @@ class Bank:
         return True
 
     def widthdraw_credits(self, user, amount):
-        server = user.server
-
         if amount < 0:
             raise NegativeValue
 
         account = self._get_account(user)
         if account["balance"] >= amount:
             account["balance"] -= amount
-            self.accounts[server.id][user.id] = account
-            self._save_bank()
+            self._save_account(user, account)
         else:
             raise InsufficientBalance
 
     def deposit_credits(self, user, amount):
-        server = user.server
         if amount < 0:
             raise NegativeValue
         account = self._get_account(user)
         account["balance"] += amount
-        self.accounts[server.id][user.id] = account
-        self._save_bank()
+        self._save_account(user, account)
 
     def set_credits(self, user, amount):
-        server = user.server
         if amount < 0:
             raise NegativeValue
         account = self._get_account(user)
         account["balance"] = amount
-        self.accounts[server.id][user.id] = account
-        self._save_bank()
+        self._save_account(user, account)
 
     def transfer_money(self, sender, receiver, amount):
         server = sender.server
@@ -126,34 +119,42 @@ class Bank:
             return False
 
     def wipe_bank(self, server):
-        self.accounts[server.id] = {}
-        self._save_bank()
+        self.accounts.delete_server(server.id)
 
     def get_server_accounts(self, server):
-        if server.id in self.accounts:
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            accounts = []
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
-            return accounts
-        else:
-            return []
+        accounts = []
+        for k, v in self.accounts.server_items(server.id):
+            v["id"] = k
+            v["server"] = server
+            acc = self._create_account_obj(v)
+            accounts.append(acc)
+        return accounts
 
     def get_all_accounts(self):
         accounts = []
-        for server_id, v in self.accounts.items():
+        for server_id in self.accounts.servers():
             server = self.bot.get_server(server_id)
             if server is None:# Servers that have since been left will be ignored
-                continue      # Same for users_id from the old bank format
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
+                continue
+            accounts.extend(self.get_server_accounts(server))
+        return accounts
+
+    def get_top_accounts(self, server=None, top=10):
+        """Richest accounts, read from the balance index. Globally, users
+           only appear once, with their richest account"""
+        accounts = []
+        sid = server.id if server is not None else None
+        # Servers that have since been left are ranked out in the query,
+        # so they can't push users off the board
+        servers = None
+        if sid is None:
+            servers = [s.id for s in self.bot.servers]
+        rows = self.accounts.top("balance", sid, top, per_user=sid is None,
+                                 servers=servers)
+        for server_id, k, v in rows:
+            v["id"] = k
+            v["server"] = server or self.bot.get_server(server_id)
+            accounts.append(self._create_account_obj(v))
         return accounts
 
     def get_balance(self, user):
@@ -176,15 +177,14 @@ class Bank:
             created_at = datetime.strptime(account["created_at"], "%Y-%m-%d %H:%M:%S"),
             server = account["server"])
 
-    def _save_bank(self):
-        dataIO.save_json("data/economy/bank.json", self.accounts)
+    def _save_account(self, user, account):
+        self.accounts.set(user.server.id, user.id, account)
 
     def _get_account(self, user):
-        server = user.server
-        try:
-            return deepcopy(self.accounts[server.id][user.id])
-        except KeyError:
+        account = self.accounts.get(user.server.id, user.id)
+        if account is None:
             raise NoAccount
+        return account
 
 class Economy:
     """Economy
@@ -203,6 +203,9 @@ class Economy:
         self.payday_register = defaultdict(dict)
         self.slot_register = defaultdict(dict)
 
+    def __unload(self):
+        self.bank.accounts.close()
+
     @commands.group(name="bank", pass_context=True)
     async def _bank(self, ctx):
         """Bank operations"""
@@ -308,11 +311,8 @@ class Economy:
         server = ctx.message.server
         if top < 1:
             top = 10
-        bank_sorted = sorted(self.bank.get_server_accounts(server),
-         key=lambda x: x.balance, reverse=True)
-        if len(bank_sorted) < top:
-            top = len(bank_sorted)
-        topten = bank_sorted[:top]
+        topten = self.bank.get_top_accounts(server, top)
+        top = len(topten)
         highscore = ""
         place = 1
         for acc in topten:
@@ -335,15 +335,8 @@ class Economy:
         Defaults to top 10"""
         if top < 1:
             top = 10
-        bank_sorted = sorted(self.bank.get_all_accounts(),
-         key=lambda x: x.balance, reverse=True)
-        unique_accounts = []
-        for acc in bank_sorted:
-            if not self.already_in_list(unique_accounts, acc):
-                unique_accounts.append(acc)
-        if len(unique_accounts) < top:
-            top = len(unique_accounts)
-        topten = unique_accounts[:top]
+        topten = self.bank.get_top_accounts(top=top)
+        top = len(topten)
         highscore = ""
         place = 1
         for acc in topten:
@@ -359,12 +352,6 @@ class Economy:
         else:
             await self.bot.say("There are no accounts in the bank.")
 
-    def already_in_list(self, accounts, user):
-        for acc in accounts:
-            if user.id == acc.id:
-                return True
-        return False
-
     @commands.command()
     async def payouts(self):
         """Shows slot machine payouts"""
@@ -524,10 +511,6 @@ def check_files():
         print("Creating default economy's settings.json...")
         fileIO(f, "save", {})
 
-    f = "data/economy/bank.json"
-    if not fileIO(f, "check"):
-        print("Creating empty bank.json...")
-        fileIO(f, "save", {})
 
 def setup(bot):
     global logger
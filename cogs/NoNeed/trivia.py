@@ -1,20 +1,23 @@
 import discord
 from discord.ext import commands
-from random import randint
+from random import randint, randrange
 from random import choice as randchoice
-from .utils.dataIO import fileIO
+from .utils.dataIO import fileIO, dataIO
 from .utils import checks
+from __main__ import router
 import datetime
 import time
 import os
+import re
 import asyncio
 
 class Trivia:
     """General commands."""
     def __init__(self, bot):
         self.bot = bot
-        self.trivia_sessions = []
+        self.trivia_sessions = {}  # channel id : TriviaSession
         self.settings = fileIO("data/trivia/settings.json", "load")
+        self.bank = QuestionBank("data/trivia/")
 
     @commands.group(pass_context=True)
     @checks.mod_or_permissions(administrator=True)
@@ -32,7 +35,7 @@ class Trivia:
         """Points required to win"""
         if score > 0:
             self.settings["TRIVIA_MAX_SCORE"] = score
-            fileIO("data/trivia/settings.json", "save", self.settings)
+            await dataIO.save_json_async("data/trivia/settings.json", self.settings)
             await self.bot.say("Points required to win set to {}".format(str(score)))
         else:
             await self.bot.say("Score must be superior to 0.")
@@ -42,7 +45,7 @@ class Trivia:
         """Maximum seconds to answer"""
         if seconds > 4:
             self.settings["TRIVIA_DELAY"] = seconds
-            fileIO("data/trivia/settings.json", "save", self.settings)
+            await dataIO.save_json_async("data/trivia/settings.json", self.settings)
             await self.bot.say("Maximum seconds to answer set to {}".format(str(seconds)))
         else:
             await self.bot.say("Seconds must be at least 5.")
@@ -56,7 +59,17 @@ class Trivia:
         else:
             self.settings["TRIVIA_BOT_PLAYS"] = True
             await self.bot.say("I'll gain a point everytime you don't answer in time.")
-        fileIO("data/trivia/settings.json", "save", self.settings)
+        await dataIO.save_json_async("data/trivia/settings.json", self.settings)
+
+    @triviaset.command(name="compile")
+    async def _compile(self, list_name : str):
+        """Precompiles a list for quicker loading"""
+        count = self.bank.compile(list_name)
+        if count is None:
+            await self.bot.say("There is no list with that name.")
+        else:
+            await self.bot.say("Compiled {} questions. The index will be kept "
+                               "up to date with the list.".format(count))
 
     @commands.command(pass_context=True)
     async def trivia(self, ctx, list_name : str=None):
@@ -69,50 +82,44 @@ class Trivia:
         if list_name == None:
             await self.trivia_list(ctx.message.author)
         elif list_name.lower() == "stop":
-            if await get_trivia_by_channel(message.channel):
-                s = await get_trivia_by_channel(message.channel)
+            s = get_trivia_by_channel(message.channel)
+            if s:
                 await s.end_game()
                 await self.bot.say("Trivia stopped.")
             else:
                 await self.bot.say("There's no trivia session ongoing in this channel.")
-        elif not await get_trivia_by_channel(message.channel):
+        elif not get_trivia_by_channel(message.channel):
             t = TriviaSession(message, self.settings)
-            self.trivia_sessions.append(t)
+            self.trivia_sessions[message.channel.id] = t
+            router.listen(check_messages, channel=message.channel.id)
             await t.load_questions(message.content)
         else:
             await self.bot.say("A trivia session is already ongoing in this channel.")
 
     async def trivia_list(self, author):
         msg = "**Available trivia lists:** \n\n```"
-        lists = os.listdir("data/trivia/")
-        if lists:
-            clean_list = []
-            for txt in lists:
-                if txt.endswith(".txt") and " " not in txt:
-                    txt = txt.replace(".txt", "")
-                    clean_list.append(txt)
-            if clean_list:
-                for i, d in enumerate(clean_list):
-                    if i % 4 == 0 and i != 0:
-                        msg = msg + d + "\n"
-                    else:
-                        msg = msg + d + "\t"
-                msg += "```"
-                await self.bot.send_message(author, msg)
-            else:
-                await self.bot.say("There are no trivia lists available.")
+        clean_list = self.bank.names()
+        if clean_list:
+            for i, d in enumerate(clean_list):
+                if i % 4 == 0 and i != 0:
+                    msg = msg + d + "\n"
+                else:
+                    msg = msg + d + "\t"
+            msg += "```"
+            await self.bot.send_message(author, msg)
         else:
             await self.bot.say("There are no trivia lists available.")
 
 class TriviaSession():
     def __init__(self, message, settings):
         self.gave_answer = ["I know this one! {}!", "Easy: {}.", "Oh really? It's {} of course."]
-        self.current_q = None # {"QUESTION" : "String", "ANSWERS" : []}
-        self.question_list = ""
+        self.current_q = None # (question, (answers))
+        self.answer_pattern = None # Matches any answer to current_q
+        self.answered = asyncio.Event()
+        self.deck = None
         self.channel = message.channel
         self.score_list = {}
         self.status = None
-        self.timer = None
         self.count = 0
         self.settings = settings
 
@@ -120,104 +127,87 @@ class TriviaSession():
         msg = msg.split(" ")
         if len(msg) == 2:
             _, qlist = msg
+            bank = trivia_manager.bank
             if qlist == "random":
-                chosen_list = randchoice(glob.glob("data/trivia/*.txt"))
-                self.question_list = self.load_list(chosen_list)
+                names = bank.names()
+                qlist = randchoice(names) if names else None
+            questions = bank.get(qlist) if qlist else None
+            if questions is None:
+                await trivia_manager.bot.say("There is no list with that name.")
+                await self.stop_trivia()
+            elif not questions:
+                await self.stop_trivia()
+            else:
+                self.deck = QuestionDeck(questions)
                 self.status = "new question"
                 self.timeout = time.perf_counter()
-                if self.question_list: await self.new_question()
-            else:
-                if os.path.isfile("data/trivia/" + qlist + ".txt"):
-                    self.question_list = self.load_list("data/trivia/" + qlist + ".txt")
-                    self.status = "new question"
-                    self.timeout = time.perf_counter()
-                    if self.question_list: await self.new_question()
-                else:
-                    await trivia_manager.bot.say("There is no list with that name.")
-                    await self.stop_trivia()
+                await self.new_question()
         else:
             await trivia_manager.bot.say("trivia [list name]")
+            await self.stop_trivia()
 
     async def stop_trivia(self):
         self.status = "stop"
-        trivia_manager.trivia_sessions.remove(self)
+        self.answered.set() # Wakes up new_question
+        trivia_manager.trivia_sessions.pop(self.channel.id, None)
+        router.unlisten(check_messages, channel=self.channel.id)
 
     async def end_game(self):
         self.status = "stop"
+        self.answered.set()
         if self.score_list:
             await self.send_table()
-        trivia_manager.trivia_sessions.remove(self)
-
-    def load_list(self, qlist):
-        with open(qlist, "r", encoding="ISO-8859-1") as f:
-            qlist = f.readlines()
-        parsed_list = []
-        for line in qlist:
-            if "`" in line and len(line) > 4:
-                line = line.replace("\n", "")
-                line = line.split("`")
-                question = line[0]
-                answers = []
-                for l in line[1:]:
-                    answers.append(l.lower().strip())
-                if len(line) >= 2:
-                    line = {"QUESTION" : question, "ANSWERS": answers} #string, list
-                    parsed_list.append(line)
-        if parsed_list != []:
-            return parsed_list
-        else:
-            self.stop_trivia()
-            return None
+        trivia_manager.trivia_sessions.pop(self.channel.id, None)
+        router.unlisten(check_messages, channel=self.channel.id)
 
     async def new_question(self):
-        for score in self.score_list.values():
-            if score == self.settings["TRIVIA_MAX_SCORE"]:
+        while self.status != "stop":
+            for score in self.score_list.values():
+                if score == self.settings["TRIVIA_MAX_SCORE"]:
+                    await self.end_game()
+                    return True
+            if not self.deck:
                 await self.end_game()
                 return True
-        if self.question_list == []:
-            await self.end_game()
-            return True
-        self.current_q = randchoice(self.question_list)
-        self.question_list.remove(self.current_q)
-        self.status = "waiting for answer"
-        self.count += 1
-        self.timer = int(time.perf_counter())
-        msg = "**Question number {}!**\n\n{}".format(str(self.count), self.current_q["QUESTION"])
-        try:
-            await trivia_manager.bot.say(msg)
-        except:
-            await asyncio.sleep(0.5)
-            await trivia_manager.bot.say(msg)
-
-        while self.status != "correct answer" and abs(self.timer - int(time.perf_counter())) <= self.settings["TRIVIA_DELAY"]:
-            if abs(self.timeout - int(time.perf_counter())) >= self.settings["TRIVIA_TIMEOUT"]:
-                await trivia_manager.bot.say("Guys...? Well, I guess I'll stop then.")
-                await self.stop_trivia()
-                return True
-            await asyncio.sleep(1) #Waiting for an answer or for the time limit
-        if self.status == "correct answer":
-            self.status = "new question"
-            await asyncio.sleep(3)
-            if not self.status == "stop":
-                await self.new_question()
-        elif self.status == "stop":
-            return True
-        else:
-            msg = randchoice(self.gave_answer).format(self.current_q["ANSWERS"][0])
-            if self.settings["TRIVIA_BOT_PLAYS"]:
-                msg += " **+1** for me!"
-                self.add_point(trivia_manager.bot.user.name)
-            self.current_q["ANSWERS"] = []
+            self.current_q = self.deck.draw()
+            self.answer_pattern = compile_answers(self.current_q[1])
+            self.answered.clear()
+            self.status = "waiting for answer"
+            self.count += 1
+            msg = "**Question number {}!**\n\n{}".format(str(self.count), self.current_q[0])
             try:
                 await trivia_manager.bot.say(msg)
-                await trivia_manager.bot.send_typing(self.channel)
             except:
                 await asyncio.sleep(0.5)
                 await trivia_manager.bot.say(msg)
+
+            try: # Until check_answer or a stop sets the event
+                await asyncio.wait_for(self.answered.wait(),
+                                       self.settings["TRIVIA_DELAY"])
+            except asyncio.TimeoutError:
+                pass
+            if self.status == "stop":
+                return True
+            if self.status != "correct answer":
+                self.answer_pattern = None
+                idle = time.perf_counter() - self.timeout
+                if idle >= self.settings["TRIVIA_TIMEOUT"]:
+                    await trivia_manager.bot.say("Guys...? Well, I guess I'll stop then.")
+                    await self.stop_trivia()
+                    return True
+                msg = randchoice(self.gave_answer).format(self.current_q[1][0])
+                if self.settings["TRIVIA_BOT_PLAYS"]:
+                    msg += " **+1** for me!"
+                    self.add_point(trivia_manager.bot.user.name)
+                try:
+                    await trivia_manager.bot.say(msg)
+                    await trivia_manager.bot.send_typing(self.channel)
+                except:
+                    await asyncio.sleep(0.5)
+                    await trivia_manager.bot.say(msg)
+            self.status = "new question"
             await asyncio.sleep(3)
-            if not self.status == "stop":
-                await self.new_question()
-        
+
     async def send_table(self):
         self.score_list = sorted(self.score_list.items(), reverse=True, key=lambda x: x[1]) # orders score from lower to higher
         t = "```Scores: \n\n"
@@ -232,20 +222,20 @@ class TriviaSession():
     async def check_answer(self, message):
         if message.author.id != trivia_manager.bot.user.id:
             self.timeout = time.perf_counter()
-            if self.current_q is not None:
-                for answer in self.current_q["ANSWERS"]:
-                    if answer in message.content.lower():
-                        self.current_q["ANSWERS"] = []
-                        self.status = "correct answer"
-                        self.add_point(message.author.name)
-                        msg = "You got it {}! **+1** to you!".format(message.author.name)
-                        try:
-                            await trivia_manager.bot.send_typing(self.channel)
-                            await trivia_manager.bot.send_message(message.channel, msg)
-                        except:
-                            await asyncio.sleep(0.5)
-                            await trivia_manager.bot.send_message(message.channel, msg)
-                        return True
+            pattern = self.answer_pattern
+            if pattern is not None and pattern.search(message.content.lower()):
+                self.answer_pattern = None
+                self.status = "correct answer"
+                self.answered.set()
+                self.add_point(message.author.name)
+                msg = "You got it {}! **+1** to you!".format(message.author.name)
+                try:
+                    await trivia_manager.bot.send_typing(self.channel)
+                    await trivia_manager.bot.send_message(message.channel, msg)
+                except:
+                    await asyncio.sleep(0.5)
+                    await trivia_manager.bot.send_message(message.channel, msg)
+                return True
 
     def add_point(self, user):
         if user in self.score_list:
@@ -257,17 +247,127 @@ class TriviaSession():
         q = randchoice(list(trivia_questions.keys()))
         return q, trivia_questions[q] # question, answer
 
-async def get_trivia_by_channel(channel):
-        for t in trivia_manager.trivia_sessions:
-            if t.channel == channel:
-                return t
-        return False
+class QuestionBank():
+    """The trivia lists of a folder, parsed once and shared by every
+       session as tuples of (question, (answers)).
+
+    A list is parsed again only when its file's mtime or size changed.
+    compile() also saves the parsed list to a binary .idx file next to it,
+    loaded from then on instead of parsing the text (and rewritten when
+    the text changes)"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._lists = {}  # name : (source key, questions)
+        self._names = (None, [])  # folder mtime, sorted list names
+
+    def names(self):
+        key = os.stat(self.folder).st_mtime_ns
+        if self._names[0] != key:
+            names = sorted(f[:-4] for f in os.listdir(self.folder)
+                           if f.endswith(".txt") and " " not in f)
+            self._names = (key, names)
+        return self._names[1]
+
+    def get(self, name):
+        """The questions of a list, None if there's no such list"""
+        path = self._path(name)
+        if path is None:
+            return None
+        st = os.stat(path)
+        key = [st.st_mtime_ns, st.st_size]
+        cached = self._lists.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        index = path[:-4] + ".idx"
+        questions = None
+        if os.path.isfile(index):
+            data = dataIO.load_json(index, frozen=True)
+            if list(data["SOURCE"]) == key:
+                questions = data["QUESTIONS"]
+            else: # Stale, bring it up to date
+                questions = self._compile(path, index, key)
+        if questions is None:
+            questions = self.parse(path)
+        self._lists[name] = (key, questions)
+        return questions
+
+    def compile(self, name):
+        """Writes the list's index, returns its number of questions or None
+           if there's no such list"""
+        path = self._path(name)
+        if path is None:
+            return None
+        st = os.stat(path)
+        key = [st.st_mtime_ns, st.st_size]
+        questions = self._compile(path, path[:-4] + ".idx", key)
+        self._lists[name] = (key, questions)
+        return len(questions)
+
+    def _compile(self, path, index, key):
+        questions = self.parse(path)
+        dataIO.set_format(index, "binary")
+        dataIO.save_json(index, {"SOURCE": key, "QUESTIONS": questions})
+        dataIO.flush(index)
+        return questions
+
+    def _path(self, name):
+        if name not in self.names(): # Also keeps out things like ../
+            return None
+        return os.path.join(self.folder, name + ".txt")
+
+    @staticmethod
+    def parse(path):
+        with open(path, "r", encoding="ISO-8859-1") as f:
+            lines = f.readlines()
+        questions = []
+        for line in lines:
+            if "`" in line and len(line) > 4:
+                line = line.replace("\n", "").split("`")
+                answers = tuple(a.lower().strip() for a in line[1:])
+                questions.append((line[0], answers))
+        return tuple(questions)
+
+class QuestionDeck():
+    """Draws the questions of a list in random order without copying it.
+
+    A Fisher-Yates shuffle done one draw at a time, the positions it
+    swapped are kept in a dict instead of a shuffled copy of the list"""
+
+    def __init__(self, questions):
+        self.questions = questions
+        self.left = len(questions)
+        self._swapped = {}  # position : index of the question now there
+
+    def __len__(self):
+        return self.left
+
+    def draw(self):
+        i = randrange(self.left)
+        self.left -= 1
+        last = self.left
+        picked = self._swapped.get(i, i)
+        moved = self._swapped.pop(last, last)
+        if i != last:
+            self._swapped[i] = moved
+        return self.questions[picked]
+
+def get_trivia_by_channel(channel):
+    return trivia_manager.trivia_sessions.get(channel.id)
+
+def compile_answers(answers):
+    """One regex finding any of the answers in a lowercase message, the
+       longest first, or None if there's no answer to find"""
+    answers = sorted({a for a in answers if a}, key=len, reverse=True)
+    if not answers:
+        return None
+    return re.compile("|".join(re.escape(a) for a in answers))
 
-async def check_messages(message):
-    if message.author.id != trivia_manager.bot.user.id:
-        if await get_trivia_by_channel(message.channel):
-            trvsession = await get_trivia_by_channel(message.channel)
-            await trvsession.check_answer(message)
+async def check_messages(route):
+    if not route.own:
+        trvsession = trivia_manager.trivia_sessions.get(route.channel_id)
+        if trvsession:
+            await trvsession.check_answer(route.message)
 
 def check_folders():
     folders = ("data", "data/trivia/")
@@ -287,6 +387,5 @@ def setup(bot):
     global trivia_manager
     check_folders()
     check_files()
-    bot.add_listener(check_messages, "on_message")
     trivia_manager = Trivia(bot)
     bot.add_cog(trivia_manager)
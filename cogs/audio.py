@@ -3,7 +3,7 @@ from discord.ext import commands
 import threading
 import os
 from random import shuffle, choice
-from cogs.utils.dataIO import fileIO
+from cogs.utils.dataIO import fileIO, dataIO
 from cogs.utils import checks
 from __main__ import send_cmd_help
 import re
@@ -14,6 +14,7 @@ import asyncio
 import math
 import time
 import inspect
+from concurrent.futures import ThreadPoolExecutor, Future
 
 __author__ = "tekulvw"
 __version__ = "0.1.1"
@@ -98,6 +99,10 @@ class InvalidPlaylist(InvalidSong):
     pass
 
 
+class NoSearchResults(InvalidSong):
+    pass
+
+
 class deque(collections.deque):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -124,34 +129,291 @@ class Song:
 
 
 
-class Downloader(threading.Thread):
+class InfoCache:
+    """youtube_dl info of songs, shared by every server.
+
+    Keyed by canonical URL, so the many ways to link a YouTube video are
+    one entry. Only the fields Song needs are kept. Entries expire after
+    `ttl` seconds, the least recently used ones are dropped past `size`.
+    Used from the extraction workers, saved from the event loop"""
+
+    FIELDS = ("id", "title", "url", "webpage_url", "duration", "uploader",
+              "extractor", "is_live")
+    YT_ID = re.compile(r'(?:youtu\.be/|[?&]v=|/embed/|/v/)([\w-]{11})')
+
+    def __init__(self, path, size=2000, ttl=6 * 3600):
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self._entries = collections.OrderedDict()  # key : (expires, info)
+        self._lock = threading.Lock()
+        dataIO.set_format(path, "compact")
+        if dataIO.is_valid_json(path):
+            now = time.time()
+            for key, expires, info in dataIO.load_json(path):
+                if expires > now:
+                    self._entries[key] = (expires, info)
+
+    def key(self, url):
+        if "youtu" in url:
+            match = self.YT_ID.search(url)
+            if match:
+                return "youtube:" + match.group(1)
+        return url.strip().rstrip("/")
+
+    def get(self, url):
+        key = self.key(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, url, info):
+        """Playlists and failed lookups aren't cached"""
+        if not info or "entries" in info or info.get("_type") == "playlist":
+            return
+        info = {k: info[k] for k in self.FIELDS if k in info}
+        key = self.key(url)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            self.dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            now = time.time()
+            data = [[k, e, i] for k, (e, i) in self._entries.items()
+                    if e > now]
+            self.dirty = False
+        dataIO.save_json(self.path, data)
+
+
+class SearchCache:
+    """Video ids of search queries, for "[SEARCH:]" plays.
+
+    Queries are compared case and whitespace insensitively. Results
+    expire after `ttl` seconds, the least recently used ones are dropped
+    past `size`. Workers asking for a query that's already being searched
+    wait for that search instead of starting their own"""
+
+    def __init__(self, size=500, ttl=24 * 3600):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # query : (expires, id)
+        self._searching = {}  # query : Future of the id
+        self._lock = threading.Lock()
+
+    def normalize(self, query):
+        return " ".join(query.casefold().split())
+
+    def resolve(self, query, search):
+        """The video id for query, calling search(query) if it's unknown"""
+        key = self.normalize(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            future = self._searching.get(key)
+            searching = future is None
+            if searching:
+                future = self._searching[key] = Future()
+                self.misses += 1
+        if not searching:
+            return future.result()
+        try:
+            yt_id = search(query)
+        except BaseException as e:
+            with self._lock:
+                del self._searching[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._searching[key]
+            self._entries[key] = (time.time() + self.ttl, yt_id)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        future.set_result(yt_id)
+        return yt_id
+
+
+class CacheIndex:
+    """Size, last play time and play count of every file in the audio
+       cache, kept up to date as songs are downloaded and played so the
+       folder doesn't have to be listed. Saved to `path`, the folder is
+       only looked at when loading it.
+
+    evict() frees space by removing the least recently played files
+    ("LRU") or the least played ones ("LFU")"""
+
+    def __init__(self, folder, path):
+        self.folder = folder
+        self.path = path
+        self.files = {}  # name : [bytes, last played, plays]
+        self.total = 0
+        self.dirty = False
+        dataIO.set_format(path, "compact")
+        saved = {}
+        if dataIO.is_valid_json(path):
+            saved = dataIO.load_json(path)
+        for name in os.listdir(folder): # In case it changed while we were off
+            entry = saved.get(name)
+            if entry is not None:
+                self.files[name] = entry
+                self.total += entry[0]
+            else:
+                self.added(name)
+        self.dirty = self.dirty or len(saved) != len(self.files)
+
+    def added(self, name):
+        try:
+            size = os.path.getsize(os.path.join(self.folder, name))
+        except OSError:
+            return
+        entry = self.files.get(name)
+        if entry is None:
+            entry = self.files[name] = [0, 0, 0]
+        self.total += size - entry[0]
+        entry[0] = size
+        self.dirty = True
+
+    def played(self, name):
+        if name not in self.files:
+            self.added(name)
+        entry = self.files.get(name)
+        if entry is not None:
+            entry[1] = time.time()
+            entry[2] += 1
+            self.dirty = True
+
+    def removed(self, name):
+        entry = self.files.pop(name, None)
+        if entry is not None:
+            self.total -= entry[0]
+            self.dirty = True
+
+    def evict(self, budget, keep=(), policy="LRU"):
+        """Removes files not in keep until the cache fits in budget bytes,
+           returns how many bytes were freed"""
+        if self.total <= budget:
+            return 0
+        if policy == "LFU":
+            order = lambda n: (self.files[n][2], self.files[n][1])
+        else:
+            order = lambda n: self.files[n][1]
+        freed = 0
+        for name in sorted((n for n in self.files if n not in keep),
+                           key=order):
+            if self.total <= budget:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass
+            except OSError: # A directory, or in use
+                continue
+            freed += self.files[name][0]
+            self.removed(name)
+        return freed
+
+    def save(self):
+        if self.dirty:
+            self.dirty = False
+            dataIO.save_json(self.path, self.files)
+
+
+class ExtractionService:
+    """Runs youtube_dl jobs on a bounded pool of worker threads.
+
+    Every worker keeps its own YoutubeDL instance, they aren't thread safe
+    but are reused from one job to the next. Jobs are callables taking
+    that instance, submit() returns an asyncio future of their result."""
+
+    def __init__(self, loop, workers=4, options=youtube_dl_options,
+                 info_cache=None, search_cache=None):
+        self.loop = loop
+        self.options = options
+        self.info_cache = info_cache
+        self.search_cache = search_cache
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._local = threading.local()
+
+    def submit(self, job):
+        return self.loop.run_in_executor(self._executor, self._run, job)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job):
+        yt = getattr(self._local, "yt", None)
+        if yt is None:
+            yt = self._local.yt = youtube_dl.YoutubeDL(self.options)
+        return job(yt)
+
+
+class Downloader:
+    """Gets a song's info, and downloads it if asked, once started on an
+       ExtractionService. wait() until it's done"""
+
     def __init__(self, url, max_duration=None, download=False,
-                 cache_path="data/audio/cache", *args, **kwargs):
-        super().__init__(*args, **kwargs)
+                 cache_path="data/audio/cache"):
         self.url = url
         self.max_duration = max_duration
-        self.done = threading.Event()
         self.song = None
         self.failed = False
+        self.hit_max_length = False
+        self.future = None
+        self.cache_path = cache_path
         self._download = download
-        self.hit_max_length = threading.Event()
         self._yt = None
+        self._info_cache = None
+        self._search_cache = None
+
+    def start(self, service):
+        if self.future is None:
+            self._info_cache = service.info_cache
+            self._search_cache = service.search_cache
+            self.future = service.submit(self.run)
+        return self.future
 
-    def run(self):
+    def is_alive(self):
+        return self.future is not None and not self.future.done()
+
+    async def wait(self):
+        if self.future is not None:
+            await asyncio.shield(self.future)
+
+    def run(self, yt):
+        self._yt = yt
         try:
             self.get_info()
             if self._download:
                 self.download()
         except MaximumLength:
-            self.hit_max_length.set()
-        except:
+            self.hit_max_length = True
+        except Exception as e:
+            log.warning("couldn't get {}: {}".format(self.url, e))
             self.failed = True
-        self.done.set()
 
     def download(self):
         self.duration_check()
 
-        if not os.path.isfile('data/audio/cache' + self.song.id):
+        if not os.path.isfile(os.path.join(self.cache_path, self.song.id)):
             video = self._yt.extract_info(self.url)
             self.song = Song(**video)
 
@@ -164,22 +426,41 @@ class Downloader(threading.Thread):
                 self.song.id, self.song.duration, self.max_duration))
 
     def get_info(self):
-        if self._yt is None:
-            self._yt = youtube_dl.YoutubeDL(youtube_dl_options)
         if "[SEARCH:]" not in self.url:
-            video = self._yt.extract_info(self.url, download=False,
-                                          process=False)
+            video = self._get_info(self.url)
         else:
             self.url = self.url[9:]
-            yt_id = self._yt.extract_info(
-                self.url, download=False)["entries"][0]["id"]
-            # Should handle errors here ^
-            self.url = "https://youtube.com/watch?v={}".format(yt_id)
-            video = self._yt.extract_info(self.url, download=False,
-                                          process=False)
+            if self._search_cache is not None:
+                yt_id = self._search_cache.resolve(self.url, self._search)
+            else:
+                yt_id = self._search(self.url)
+            if "://" in yt_id: # The result's url, not its id
+                self.url = yt_id
+            else:
+                self.url = "https://youtube.com/watch?v={}".format(yt_id)
+            video = self._get_info(self.url)
 
         self.song = Song(**video)
 
+    def _search(self, query):
+        # Unprocessed, the first result's id is all we need. Flat entries
+        # from some extractor versions only have the url
+        results = self._yt.extract_info("ytsearch1:" + query,
+                                        download=False, process=False)
+        entry = next(iter(results.get("entries") or ()), None)
+        if not entry or not (entry.get("id") or entry.get("url")):
+            raise NoSearchResults("no results for {}".format(query))
+        return entry.get("id") or entry["url"]
+
+    def _get_info(self, url):
+        cache = self._info_cache
+        video = cache.get(url) if cache is not None else None
+        if video is None:
+            video = self._yt.extract_info(url, download=False, process=False)
+            if cache is not None:
+                cache.put(url, video)
+        return video
+
 
 class Audio:
     """Music Streaming."""
@@ -193,21 +474,33 @@ class Audio:
                                              "VOTE_THRESHOLD"]
         self.cache_path = "data/audio/cache"
         self.local_playlist_path = "data/audio/localtracks"
+        self.cache_index = CacheIndex(self.cache_path,
+                                      "data/audio/cache_index.json")
+        self.info_cache = InfoCache("data/audio/info_cache.json")
+        self.search_cache = SearchCache()
+        self.queue_events = {}  # sid : asyncio.Event, set to wake its worker
+        self.queue_tasks = {}  # sid : queue_worker task, active servers only
+        self.extractor = ExtractionService(bot.loop,
+                                           info_cache=self.info_cache,
+                                           search_cache=self.search_cache)
 
     def _add_to_queue(self, server, url):
         if server.id not in self.queue:
             self._setup_queue(server)
         self.queue[server.id]["QUEUE"].append(url)
+        self._wake_queue(server.id)
 
     def _add_to_temp_queue(self, server, url):
         if server.id not in self.queue:
             self._setup_queue(server)
         self.queue[server.id]["TEMP_QUEUE"].append(url)
+        self._wake_queue(server.id)
 
     def _addleft_to_queue(self, server, url):
         if server.id not in self.queue:
-            self._setup_queue()
+            self._setup_queue(server)
         self.queue[server.id]["QUEUE"].appendleft(url)
+        self._wake_queue(server.id)
 
     def _cache_desired_files(self):
         filelist = []
@@ -217,7 +510,6 @@ class Audio:
                 filelist.append(song.id)
             except AttributeError:
                 pass
-        shuffle(filelist)
         return filelist
 
     def _cache_max(self):
@@ -229,10 +521,9 @@ class Audio:
         return max([60, 48 * math.log(x) * x**0.3])  # log is not log10
 
     def _cache_required_files(self):
-        queue = copy.deepcopy(self.queue)
         filelist = []
-        for server in queue:
-            now_playing = queue[server].get("NOW_PLAYING")
+        for server_queue in self.queue.values():
+            now_playing = server_queue.get("NOW_PLAYING")
             try:
                 filelist.append(now_playing.id)
             except AttributeError:
@@ -240,10 +531,7 @@ class Audio:
         return filelist
 
     def _cache_size(self):
-        songs = os.listdir(self.cache_path)
-        size = sum(map(lambda s: os.path.getsize(
-            os.path.join(self.cache_path, s)) / 10**6, songs))
-        return size
+        return self.cache_index.total / 10**6
 
     def _cache_too_large(self):
         if self._cache_size() > self._cache_max():
@@ -255,6 +543,7 @@ class Audio:
             return
         self.queue[server.id]["QUEUE"] = deque()
         self.queue[server.id]["TEMP_QUEUE"] = deque()
+        self._wake_queue(server.id)
 
     async def _create_ffmpeg_player(self, server, filename, local=False):
         """This function will guarantee we have a valid voice client,
@@ -302,8 +591,12 @@ class Audio:
 
         log.debug("making player on sid {}".format(server.id))
 
+        def after():  # Called from the player's thread
+            self.bot.loop.call_soon_threadsafe(self._wake_queue, server.id)
+
         voice_client.audio_player = voice_client.create_ffmpeg_player(
-            song_filename, use_avconv=use_avconv, options=options)
+            song_filename, use_avconv=use_avconv, options=options,
+            after=after)
 
         return voice_client  # Just for ease of use, it's modified in-place
 
@@ -338,11 +631,10 @@ class Audio:
         downloaders = []
         for url in url_list:
             d = Downloader(url)
-            d.start()
+            d.start(self.extractor)
             downloaders.append(d)
 
-        while any([d.is_alive() for d in downloaders]):
-            await asyncio.sleep(0.1)
+        await asyncio.gather(*[d.wait() for d in downloaders])
 
         songs = [d.song for d in downloaders]
         return songs
@@ -358,8 +650,7 @@ class Audio:
 
         max_length = self.settings["MAX_LENGTH"]
 
-        while next_dl.is_alive():
-            await asyncio.sleep(0.5)
+        await next_dl.wait()
 
         if curr_dl.song.id != next_dl.song.id:
             log.debug("downloader ID's mismatch on sid {}".format(server.id) +
@@ -371,7 +662,8 @@ class Audio:
                 return
             self.downloaders[server.id] = Downloader(next_dl.url, max_length,
                                                      download=True)
-            self.downloaders[server.id].start()
+            self.downloaders[server.id].start(self.extractor)
+            self._track_download(server, self.downloaders[server.id])
 
     def _dump_cache(self, ignore_desired=False):
         reqd = self._cache_required_files()
@@ -380,22 +672,12 @@ class Audio:
         opt = self._cache_desired_files()
         log.debug("desired cache files:\n\t{}".format(opt))
 
-        prev_size = self._cache_size()
-
-        for file in os.listdir(self.cache_path):
-            if file not in reqd:
-                if ignore_desired or file not in opt:
-                    try:
-                        os.remove(os.path.join(self.cache_path, file))
-                    except OSError:
-                        # A directory got in the cache?
-                        pass
-                    except WindowsError:
-                        # Removing a file in use, reqd failed
-                        pass
-
-        post_size = self._cache_size()
-        dumped = prev_size - post_size
+        keep = set(reqd)
+        if not ignore_desired:
+            keep.update(opt)
+        budget = self._cache_max() * 10**6
+        policy = self.settings.get("CACHE_POLICY", "LRU")
+        dumped = self.cache_index.evict(budget, keep, policy) / 10**6
 
         if not ignore_desired and self._cache_too_large():
             log.debug("must dump desired files")
@@ -420,16 +702,13 @@ class Audio:
             log.debug("sid {} in downloaders but wrong url".format(server.id))
             self.downloaders[server.id] = Downloader(url, max_length)
 
-        try:
-            # We're assuming we have the right thing in our downloader object
-            self.downloaders[server.id].start()
-            log.debug("starting our downloader for sid {}".format(server.id))
-        except RuntimeError:
-            # Queue manager already started it for us, isn't that nice?
-            pass
+        # We're assuming we have the right thing in our downloader object,
+        #   queue manager might have started it for us already
+        self.downloaders[server.id].start(self.extractor)
+        log.debug("starting our downloader for sid {}".format(server.id))
 
         # Getting info w/o download
-        self.downloaders[server.id].done.wait()
+        await self.downloaders[server.id].wait()
 
         # This will throw a maxlength exception if required
         self.downloaders[server.id].duration_check()
@@ -443,10 +722,9 @@ class Audio:
             log.debug("cache miss on song id {}".format(song.id))
             self.downloaders[server.id] = Downloader(url, max_length,
                                                      download=True)
-            self.downloaders[server.id].start()
-
-            while self.downloaders[server.id].is_alive():
-                await asyncio.sleep(0.5)
+            self.downloaders[server.id].start(self.extractor)
+            self._track_download(server, self.downloaders[server.id])
+            await self.downloaders[server.id].wait()
 
             song = self.downloaders[server.id].song
         else:
@@ -454,6 +732,13 @@ class Audio:
 
         return song
 
+    def _track_download(self, server, downloader):
+        def done(future):
+            if downloader.song is not None and downloader.song.id:
+                self.cache_index.added(downloader.song.id)
+            self._wake_queue(server.id)  # It may download the next one now
+        downloader.future.add_done_callback(done)
+
     async def _join_voice_channel(self, channel):
         server = channel.server
         if server.id in self.queue:
@@ -511,10 +796,8 @@ class Audio:
     async def _parse_sc_playlist(self, url):
         playlist = []
         d = Downloader(url)
-        d.start()
-
-        while d.is_alive():
-            await asyncio.sleep(0.5)
+        d.start(self.extractor)
+        await d.wait()
 
         for entry in d.song.entries:
             if entry["url"][4] != "s":
@@ -527,11 +810,9 @@ class Audio:
 
     async def _parse_yt_playlist(self, url):
         d = Downloader(url)
-        d.start()
+        d.start(self.extractor)
         playlist = []
-
-        while d.is_alive():
-            await asyncio.sleep(0.5)
+        await d.wait()
 
         for entry in d.song.entries:
             try:
@@ -566,6 +847,7 @@ class Audio:
                             "{}".format(self.bot.command_prefix[0], url))
                 raise
             local = False
+            self.cache_index.played(song.id)
         else:  # Assume local
             try:
                 song = self._make_local_song(url)
@@ -615,8 +897,7 @@ class Audio:
 
     def _player_count(self):
         count = 0
-        queue = copy.deepcopy(self.queue)
-        for sid in queue:
+        for sid in list(self.queue):
             server = self.bot.get_server(sid)
             try:
                 vc = self.voice_client(server)
@@ -685,6 +966,7 @@ class Audio:
         else:
             self._setup_queue(server)
         self.queue[server.id]["QUEUE"].extend(songlist)
+        self._wake_queue(server.id)
 
     def _set_queue_channel(self, server, channel):
         if server.id not in self.queue:
@@ -844,6 +1126,8 @@ class Audio:
                 log.debug("cache too large ({} > {}), dumping".format(
                     self._cache_size(), self._cache_max()))
                 self._dump_cache()
+            self.info_cache.save()
+            self.cache_index.save()
             await asyncio.sleep(5)  # No need to run this every half second
 
     async def cache_scheduler(self):
@@ -924,7 +1208,7 @@ class Audio:
 
     async def queue_manager(self, sid):
         """This function assumes that there's something in the queue for us to
-            play"""
+            play. Returns True if a song was skipped for being too long"""
         server = self.bot.get_server(sid)
         max_length = self.settings["MAX_LENGTH"]
 
@@ -948,20 +1232,24 @@ class Audio:
                 try:
                     song = await self._play(sid, temp_queue.popleft())
                 except MaximumLength:
-                    return
+                    return True
             elif len(queue) > 0:  # We're in the normal queue
                 url = queue.popleft()
                 log.debug("calling _play on the normal queue")
                 try:
                     song = await self._play(sid, url)
                 except MaximumLength:
-                    return
+                    return True
                 if repeat and last_song:
                     queue.append(last_song.webpage_url)
             else:
                 song = None
             self.queue[server.id]["NOW_PLAYING"] = song
             log.debug("set now_playing for sid {}".format(server.id))
+            if song is not None:
+                # Prefetch the next song now, a song played from the cache
+                # starts no download that would wake us up for it
+                self._wake_queue(server.id)
         elif server.id in self.downloaders:
             # We're playing but we might be able to download a new song
             curr_dl = self.downloaders.get(server.id)
@@ -975,26 +1263,61 @@ class Audio:
 
             if next_dl is not None:
                 # Download next song
-                next_dl.start()
+                next_dl.start(self.extractor)
                 await self._download_next(server, curr_dl, next_dl)
+        return False
 
-    async def queue_scheduler(self):
-        while self == self.bot.get_cog('Audio'):
-            tasks = []
-            queue = copy.deepcopy(self.queue)
-            for sid in queue:
-                if len(queue[sid]["QUEUE"]) == 0 and \
-                        len(queue[sid]["TEMP_QUEUE"]) == 0:
+    def _wake_queue(self, sid):
+        """Has sid's queue worker look at its queue, starting one if needed"""
+        event = self.queue_events.get(sid)
+        if event is None:
+            event = self.queue_events[sid] = asyncio.Event()
+        event.set()
+        task = self.queue_tasks.get(sid)
+        if task is None or task.done():
+            self.queue_tasks[sid] = \
+                self.bot.loop.create_task(self.queue_worker(sid))
+
+    async def queue_worker(self, sid):
+        """Runs queue_manager for sid when its queue changes, a song ends or
+            a download finishes. Exits once the queue is empty,
+            _wake_queue starts it again"""
+        event = self.queue_events[sid]
+        retry = 0  # Seconds, while the queue can't be started
+        try:
+            while self == self.bot.get_cog('Audio'):
+                if retry:
+                    try:
+                        await asyncio.wait_for(event.wait(), retry)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await event.wait()
+                event.clear()
+                queue = self.queue.get(sid)
+                if queue is None or (len(queue["QUEUE"]) == 0 and
+                                     len(queue["TEMP_QUEUE"]) == 0):
+                    break
+                try:
+                    skipped = await self.queue_manager(sid)
+                except Exception:
+                    log.exception("queue manager error on sid {}".format(sid))
+                    skipped = False
+                if skipped:
+                    # A song was too long, try the next one right away
+                    event.set()
                     continue
-                # log.debug("scheduler found a non-empty queue"
-                #           " for sid: {}".format(sid))
-                tasks.append(
-                    self.bot.loop.create_task(self.queue_manager(sid)))
-            completed = [t.done() for t in tasks]
-            while not all(completed):
-                completed = [t.done() for t in tasks]
-                await asyncio.sleep(0.5)
-            await asyncio.sleep(1)
+                server = self.bot.get_server(sid)
+                if server is not None and not self.is_playing(server):
+                    # Nothing could start, the voice client isn't ready or
+                    # the entry isn't playable. Look again later unless an
+                    # event comes first
+                    retry = min(retry * 2 or 1, 30)
+                else:
+                    retry = 0
+        finally:
+            # Still ours, _wake_queue only replaces finished tasks
+            self.queue_tasks.pop(sid, None)
 
     async def reload_monitor(self):
         while self == self.bot.get_cog('Audio'):
@@ -1005,6 +1328,11 @@ class Audio:
                 vc.audio_player.stop()
             except:
                 pass
+        for task in list(self.queue_tasks.values()):
+            task.cancel()
+        self.extractor.shutdown()
+        self.info_cache.save()
+        self.cache_index.save()
 
     def save_settings(self):
         fileIO('data/audio/settings.json', 'save', self.settings)
@@ -1062,7 +1390,7 @@ def check_files():
     default = {"VOLUME": 50, "MAX_LENGTH": 3700, "QUEUE_MODE": True,
                "MAX_CACHE": 0, "SOUNDCLOUD_CLIENT_ID": None,
                "TITLE_STATUS": True, "AVCONV": False, "VOTE_THRESHOLD": 50,
-               "SERVERS": {}}
+               "CACHE_POLICY": "LRU", "SERVERS": {}}
     settings_path = "data/audio/settings.json"
 
     if not os.path.isfile(settings_path):
@@ -1101,7 +1429,6 @@ def setup(bot):
     n = Audio(bot)  # Praise 26
     bot.add_cog(n)
     bot.add_listener(n.voice_state_update, 'on_voice_state_update')
-    bot.loop.create_task(n.queue_scheduler())
     bot.loop.create_task(n.disconnect_timer())
     bot.loop.create_task(n.reload_monitor())
     bot.loop.create_task(n.cache_scheduler())
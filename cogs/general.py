@@ -1,6 +1,7 @@
 import discord
 from discord.ext import commands
 from .utils.chat_formatting import *
+from __main__ import router
 from random import randint
 from random import choice as randchoice
 import datetime
@@ -8,7 +9,7 @@ import time
 import aiohttp
 import asyncio
 
-settings = {"POLL_DURATION" : 7200}
+settings = {"POLL_DURATION" : 7200, "POLL_TALLY_INTERVAL" : 5}
 
 class General:
     """General commands."""
@@ -20,7 +21,7 @@ class General:
                      "Signs point to yes", "Without a doubt", "Yes", "Yes – definitely", "You may rely on it", "Reply hazy, try again",
                      "Ask again later", "Better not tell you now", "Cannot predict now", "Concentrate and ask again",
                      "Don't count on it", "My reply is no", "My sources say no", "Outlook not so good", "Very doubtful"]
-        self.poll_sessions = []
+        self.poll_sessions = {}  # channel id : NewPoll
 
     @commands.command(hidden=True)
     async def ping(self):
@@ -131,7 +132,8 @@ class General:
                 return
             p = NewPoll(message, self)
             if p.valid:
-                self.poll_sessions.append(p)
+                self.poll_sessions[message.channel.id] = p
+                router.listen(self.check_poll_votes, channel=message.channel.id)
                 await p.start()
             else:
                 await self.bot.say("poll question;option1;option2 (...)")
@@ -139,25 +141,25 @@ class General:
             await self.bot.say("A poll is already ongoing in this channel.")
 
     async def endpoll(self, message):
-        if self.getPollByChannel(message):
-            p = self.getPollByChannel(message)
+        p = self.getPollByChannel(message)
+        if p:
             if p.author == message.author.id: # or isMemberAdmin(message)
-                await self.getPollByChannel(message).endPoll()
+                await p.endPoll()
             else:
                 await self.bot.say("Only admins and the author can stop the poll.")
         else:
             await self.bot.say("There's no poll ongoing in this channel.")
 
     def getPollByChannel(self, message):
-        for poll in self.poll_sessions:
-            if poll.channel == message.channel:
-                return poll
-        return False
+        return self.poll_sessions.get(message.channel.id, False)
 
-    async def check_poll_votes(self, message):
-        if message.author.id != self.bot.user.id:
-            if self.getPollByChannel(message):
-                    self.getPollByChannel(message).checkAnswer(message)
+    async def check_poll_votes(self, route):
+        content = route.message.content
+        if len(content) > 8 or not content.strip().isdigit() or route.own:
+            return # Can't be a vote
+        poll = self.poll_sessions.get(route.channel_id)
+        if poll:
+            poll.checkAnswer(route.message)
 
 class NewPoll():
     def __init__(self, message, main):
@@ -165,6 +167,7 @@ class NewPoll():
         self.author = message.author.id
         self.client = main.bot
         self.poll_sessions = main.poll_sessions
+        self.listener = main.check_poll_votes
         msg = message.content[6:]
         msg = msg.split(";")
         if len(msg) < 2: # Needs at least one question and 2 choices
@@ -172,7 +175,10 @@ class NewPoll():
             return None
         else:
             self.valid = True
-        self.already_voted = []
+        self.already_voted = set()
+        self.message = None
+        self.changed = False # Votes not shown by the poll message yet
+        self.tally_task = None
         self.question = msg[0]
         msg.remove(self.question)
         self.answers = {}
@@ -182,37 +188,58 @@ class NewPoll():
             i += 1
 
     async def start(self):
-        msg = "**POLL STARTED!**\n\n{}\n\n".format(self.question)
-        for id, data in self.answers.items():
-            msg += "{}. *{}*\n".format(id, data["ANSWER"])
-        msg += "\nType the number to vote! \nThe default duration of a poll is 120 minutes. Remember to end the poll with ?poll stop"
-        await self.client.send_message(self.channel, msg)
+        self.message = await self.client.send_message(self.channel,
+                                                      self.started_message())
+        self.tally_task = self.client.loop.create_task(self.tally())
         await asyncio.sleep(settings["POLL_DURATION"])
         if self.valid:
             await self.endPoll()
 
+    def started_message(self):
+        msg = "**POLL STARTED!**\n\n{}\n\n".format(self.question)
+        for id, data in self.answers.items():
+            msg += "{}. *{}* - {} votes\n".format(id, data["ANSWER"], str(data["VOTES"]))
+        msg += "\nType the number to vote! \nThe default duration of a poll is 120 minutes. Remember to end the poll with ?poll stop"
+        return msg
+
+    async def tally(self):
+        """Keeps the votes on the poll message up to date, with one edit
+           every POLL_TALLY_INTERVAL seconds at most however many votes
+           came in"""
+        while self.valid:
+            await asyncio.sleep(settings["POLL_TALLY_INTERVAL"])
+            if not (self.valid and self.changed):
+                continue
+            self.changed = False
+            try:
+                await self.client.edit_message(self.message,
+                                               self.started_message())
+            except discord.errors.HTTPException:
+                pass
+
     async def endPoll(self):
         self.valid = False
+        if self.tally_task is not None:
+            self.tally_task.cancel()
         msg = "**POLL ENDED!**\n\n{}\n\n".format(self.question)
         for data in self.answers.values():
             msg += "*{}* - {} votes\n".format(data["ANSWER"], str(data["VOTES"]))
         await self.client.send_message(self.channel, msg)
-        self.poll_sessions.remove(self)
+        if self.poll_sessions.get(self.channel.id) is self:
+            del self.poll_sessions[self.channel.id]
+        router.unlisten(self.listener, channel=self.channel.id)
 
     def checkAnswer(self, message):
         try:
             i = int(message.content)
-            if i in self.answers.keys():
-                if message.author.id not in self.already_voted:
-                    data = self.answers[i]
-                    data["VOTES"] += 1
-                    self.answers[i] = data
-                    self.already_voted.append(message.author.id)
         except ValueError:
-            pass
+            return
+        if i in self.answers and message.author.id not in self.already_voted:
+            self.answers[i]["VOTES"] += 1
+            self.already_voted.add(message.author.id)
+            self.changed = True
 
 
 def setup(bot):
     n = General(bot)
-    bot.add_listener(n.check_poll_votes, "on_message")
     bot.add_cog(n)
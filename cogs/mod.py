@@ -1,13 +1,17 @@
 import discord
 from discord.ext import commands
 from .utils.dataIO import fileIO, dataIO
+from .utils.sqlstore import KeyedStore
+from .utils.access import AccessIndex
+from .utils.wordfilter import WordFilter
 from .utils import checks
-from __main__ import send_cmd_help, settings
+from __main__ import send_cmd_help, settings, router
 from collections import deque
 from cogs.utils.chat_formatting import escape_mass_mentions
 import os
 import logging
 import asyncio
+import time
 
 
 class Mod:
@@ -18,10 +22,28 @@ class Mod:
         self.whitelist_list = dataIO.load_json("data/mod/whitelist.json")
         self.blacklist_list = dataIO.load_json("data/mod/blacklist.json")
         self.ignore_list = dataIO.load_json("data/mod/ignorelist.json")
+        self.access = AccessIndex(settings, self.blacklist_list,
+                                  self.whitelist_list,
+                                  self.ignore_list["SERVERS"],
+                                  self.ignore_list["CHANNELS"])
         self.filter = dataIO.load_json("data/mod/filter.json")
+        self.filter_options = dataIO.load_json("data/mod/filter_options.json")
+        self.filters = {}  # server id : WordFilter
+        for server_id, words in self.filter.items():
+            self._compile_filter(server_id)
+            if words:
+                router.listen(self.check_filter, server=server_id)
+        dataIO.use_journal("data/mod/past_names.json")
+        dataIO.set_format("data/mod/past_names.json", "binary")
         self.past_names = dataIO.load_json("data/mod/past_names.json")
-        self.past_nicknames = dataIO.load_json("data/mod/past_nicknames.json")
+        self.past_nicknames = KeyedStore("data/mod/past_nicknames.db",
+                                         "past_nicknames")
+        self.past_nicknames.migrate_json("data/mod/past_nicknames.json")
         self.disabled_commands = fileIO("data/simbad/disabled_commands.json", "load")
+        self.delete_limiters = {}  # channel id : (single, bulk) RateLimiter
+
+    def __unload(self):
+        self.past_nicknames.close()
 
     @commands.group(pass_context=True, no_pm=True)
     @checks.mod_or_permissions(manage_messages=True)
@@ -46,50 +68,9 @@ class Mod:
             number = 1
         author = ctx.message.author
         message = ctx.message
-        channel = ctx.message.channel
         logger.info("{}({}) deleted {} messages containing '{}' in channel {}".format(author.name,
             author.id, str(number), text, message.channel.name))
-        if self.bot.user.bot and self.discordpy_updated():
-            def to_delete(m):
-                if m == ctx.message or text in m.content:
-                    return True
-                else:
-                    return False
-            try:
-                await self.bot.purge_from(channel, limit=number+1, check=to_delete)
-            except discord.errors.Forbidden:
-                await self.bot.say("I need permissions to manage messages "
-                                   "in this channel.")
-        else:
-            await self.legacy_cleanup_text_messages(ctx, text, number)
-
-    async def legacy_cleanup_text_messages(self, ctx, text, number):
-        message = ctx.message
-        cmdmsg = ctx.message
-        if self.bot.user.bot:
-            print("Your discord.py is outdated, defaulting to slow deletion.")
-        try:
-            if number > 0 and number < 10000:
-                while True:
-                    new = False
-                    async for x in self.bot.logs_from(message.channel, limit=100, before=message):
-                        if number == 0:
-                            await self._delete_message(cmdmsg)
-                            await asyncio.sleep(0.25)
-                            return
-                        if text in x.content:
-                            await self._delete_message(x)
-                            await asyncio.sleep(0.25)
-                            number -= 1
-                        new = True
-                        message = x
-                    if not new or number == 0:
-                        await self._delete_message(cmdmsg)
-                        await asyncio.sleep(0.25)
-                        break
-        except discord.errors.Forbidden:
-            await self.bot.send_message(message.channel, "I need permissions"
-                 " to manage messages in this channel.")
+        await self._cleanup(ctx, lambda m: text in m.content, number)
 
     @cleanup.command(pass_context=True, no_pm=True)
     async def user(self, ctx, user: discord.Member, number: int):
@@ -101,23 +82,10 @@ class Mod:
         if number < 1:
             number = 1
         author = ctx.message.author
-        channel = ctx.message.channel
         message = ctx.message
         logger.info("{}({}) deleted {} messages made by {}({}) in channel {}".format(author.name,
             author.id, str(number), user.name, user.id, message.channel.name))
-        if self.bot.user.bot and self.discordpy_updated():
-            def is_user(m):
-                if m == ctx.message or m.author == user:
-                    return True
-                else:
-                    return False
-            try:
-                await self.bot.purge_from(channel, limit=number+1, check=is_user)
-            except discord.errors.Forbidden:
-                await self.bot.say("I need permissions to manage messages "
-                                   "in this channel.")
-        else:
-            await self.legacy_cleanup_user_messages(ctx, user, number)
+        await self._cleanup(ctx, lambda m: m.author.id == user.id, number)
 
     @cleanup.command(pass_context=True, no_pm=True)
     async def after(self, ctx, message_id : int):
@@ -142,42 +110,7 @@ class Mod:
         except discord.errors.HTTPException:
             await self.bot.say("Couldn't retrieve the message.")
             return
-
-        try:
-            await self.bot.purge_from(channel, limit=2500, after=message)
-        except discord.errors.Forbidden:
-                await self.bot.say("I need permissions to manage messages "
-                                   "in this channel.")
-
-    async def legacy_cleanup_user_messages(self, ctx, user, number):
-        author = ctx.message.author
-        message = ctx.message
-        cmdmsg = ctx.message
-        if self.bot.user.bot:
-            print("Your discord.py is outdated, defaulting to slow deletion.")
-        try:
-            if number > 0 and number < 10000:
-                while True:
-                    new = False
-                    async for x in self.bot.logs_from(message.channel, limit=100, before=message):
-                        if number == 0:
-                            await self._delete_message(cmdmsg)
-                            await asyncio.sleep(0.25)
-                            return
-                        if x.author.id == user.id:
-                            await self._delete_message(x)
-                            await asyncio.sleep(0.25)
-                            number -= 1
-                        new = True
-                        message = x
-                    if not new or number == 0:
-                        await self._delete_message(cmdmsg)
-                        await asyncio.sleep(0.25)
-                        break
-        except discord.errors.Forbidden:
-            await self.bot.send_message(ctx.channel, "I need permissions "
-                            "to manage messages in this channel.")
-
+        await self._cleanup(ctx, after=message)
 
     @cleanup.command(pass_context=True, no_pm=True)
     async def messages(self, ctx, number: int):
@@ -191,26 +124,49 @@ class Mod:
         channel = ctx.message.channel
         logger.info("{}({}) deleted {} messages in channel {}".format(author.name,
             author.id, str(number), channel.name))
-        if self.bot.user.bot and self.discordpy_updated():
-            try:
-                await self.bot.purge_from(channel, limit=number+1)
-            except discord.errors.Forbidden:
-                await self.bot.say("I need permissions to manage messages in this channel.")
-        else:
-            await self.legacy_cleanup_messages(ctx, number)
+        await self._cleanup(ctx, number=number)
 
-    async def legacy_cleanup_messages(self, ctx, number):
-        author = ctx.message.author
+    async def _cleanup(self, ctx, check=None, number=None, after=None):
+        """Deletes the messages before the command passing check, at most
+           number of them, and the command itself. With after, everything
+           between that message and now instead"""
         channel = ctx.message.channel
-        if self.bot.user.bot:
-                print("Your discord.py is outdated, defaulting to slow deletion.")
+        if number is not None:
+            number = min(number, 10000)
+        for channel_id, pair in list(self.delete_limiters.items()):
+            if all(limiter.idle() for limiter in pair):
+                del self.delete_limiters[channel_id]
+        limiters = self.delete_limiters.get(channel.id)
+        if limiters is None: # Shared by the cleanups running in a channel
+            limiters = (RateLimiter(5, 5), RateLimiter(1, 2))
+            self.delete_limiters[channel.id] = limiters
+        if after is None:
+            # Filtered cleanups only look that far back for matches
+            scan = max(number * 10, 1000) if check is not None else None
+            engine = DeletionEngine(self.bot, channel, limiters, check, number,
+                                    before=ctx.message, scan=scan,
+                                    extra=[ctx.message])
+        else:
+            engine = DeletionEngine(self.bot, channel, limiters, after=after,
+                                    scan=10000)
+        engine.bulk = self.bot.user.bot and self.discordpy_updated()
         try:
-            if number > 0 and number < 10000:
-                async for x in self.bot.logs_from(channel, limit=number + 1):
-                    await self._delete_message(x)
-                    await asyncio.sleep(0.25)
+            await engine.run()
         except discord.errors.Forbidden:
-            await self.bot.send_message(channel, "I need permissions to manage messages in this channel.")
+            await self.bot.send_message(channel, "I need permissions to "
+                                        "manage messages in this channel.")
+            return
+        except discord.errors.HTTPException as e: # Reading the history
+            logger.warning("Cleanup in channel {} stopped: {}".format(
+                channel.id, e))
+            await self.bot.send_message(channel, "Discord had an error, the "
+                                        "cleanup stopped after deleting {} "
+                                        "messages.".format(engine.deleted))
+            return
+        if engine.failed:
+            await self.bot.send_message(channel, "Deleted {} messages, {} "
+                                        "couldn't be deleted.".format(
+                                            engine.deleted, engine.failed))
 
     @commands.group(name="command", pass_context=True)
     @checks.admin_or_permissions(manage_messages=True)
@@ -292,8 +248,9 @@ class Mod:
     @blacklist.command(name="add")
     async def _blacklist_add(self, user: discord.Member):
         """Adds user to bot's blacklist"""
-        if user.id not in self.blacklist_list:
+        if user.id not in self.access.blacklist:
             self.blacklist_list.append(user.id)
+            self.access.blacklist.add(user.id)
             fileIO("data/mod/blacklist.json", "save", self.blacklist_list)
             await self.bot.say("User has been added to blacklist.")
         else:
@@ -302,8 +259,9 @@ class Mod:
     @blacklist.command(name="remove")
     async def _blacklist_remove(self, user: discord.Member):
         """Removes user to bot's blacklist"""
-        if user.id in self.blacklist_list:
+        if user.id in self.access.blacklist:
             self.blacklist_list.remove(user.id)
+            self.access.blacklist.discard(user.id)
             fileIO("data/mod/blacklist.json", "save", self.blacklist_list)
             await self.bot.say("User has been removed from blacklist.")
         else:
@@ -319,12 +277,13 @@ class Mod:
     @whitelist.command(name="add")
     async def _whitelist_add(self, user: discord.Member):
         """Adds user to bot's whitelist"""
-        if user.id not in self.whitelist_list:
+        if user.id not in self.access.whitelist:
             if not self.whitelist_list:
                 msg = "\nAll users not in whitelist will be ignored (owner, admins and mods excluded)"
             else:
                 msg = ""
             self.whitelist_list.append(user.id)
+            self.access.whitelist.add(user.id)
             fileIO("data/mod/whitelist.json", "save", self.whitelist_list)
             await self.bot.say("User has been added to whitelist." + msg)
         else:
@@ -333,8 +292,9 @@ class Mod:
     @whitelist.command(name="remove")
     async def _whitelist_remove(self, user: discord.Member):
         """Removes user to bot's whitelist"""
-        if user.id in self.whitelist_list:
+        if user.id in self.access.whitelist:
             self.whitelist_list.remove(user.id)
+            self.access.whitelist.discard(user.id)
             fileIO("data/mod/whitelist.json", "save", self.whitelist_list)
             await self.bot.say("User has been removed from whitelist.")
         else:
@@ -375,12 +335,15 @@ class Mod:
         added = 0
         if server.id not in self.filter.keys():
             self.filter[server.id] = []
+            self._compile_filter(server.id)
         for w in words:
             if w.lower() not in self.filter[server.id] and w != "":
                 self.filter[server.id].append(w.lower())
+                self.filters[server.id].add(w.lower())
                 added += 1
         if added:
             fileIO("data/mod/filter.json", "save", self.filter)
+            router.listen(self.check_filter, server=server.id)
             await self.bot.say("Words added to filter.")
         else:
             await self.bot.say("Words already in the filter.")
@@ -404,16 +367,39 @@ class Mod:
         for w in words:
             if w.lower() in self.filter[server.id]:
                 self.filter[server.id].remove(w.lower())
+                self.filters[server.id].remove(w.lower())
                 removed += 1
         if removed:
             fileIO("data/mod/filter.json", "save", self.filter)
+            if not self.filter[server.id]:
+                router.unlisten(self.check_filter, server=server.id)
             await self.bot.say("Words removed from filter.")
         else:
             await self.bot.say("Those words weren't in the filter.")
 
+    @_filter.command(name="strict", pass_context=True)
+    async def filter_strict(self, ctx):
+        """Toggles catching filtered words written with accents,
+        fullwidth or lookalike letters from other alphabets"""
+        server = ctx.message.server
+        options = self.filter_options.setdefault(server.id, {})
+        options["STRICT"] = not options.get("STRICT", False)
+        dataIO.save_json("data/mod/filter_options.json", self.filter_options)
+        if server.id in self.filter:
+            self._compile_filter(server.id)
+        if options["STRICT"]:
+            await self.bot.say("Strict filtering enabled.")
+        else:
+            await self.bot.say("Strict filtering disabled.")
+
+    def _compile_filter(self, server_id):
+        strict = self.filter_options.get(server_id, {}).get("STRICT", False)
+        self.filters[server_id] = WordFilter(self.filter[server_id],
+                                             confusables=strict)
+
     def discordpy_updated(self):
         try:
-            assert self.bot.purge_from
+            assert self.bot.delete_messages
         except:
             return False
         return True
@@ -428,42 +414,47 @@ class Mod:
 
     def immune_from_filter(self, message):
         user = message.author
-        server = message.server
-        admin_role = settings.get_server_admin(server)
-        mod_role = settings.get_server_mod(server)
 
         if user.id == settings.owner:
             return True
-        elif discord.utils.get(user.roles, name=admin_role):
-            return True
-        elif discord.utils.get(user.roles, name=mod_role):
-            return True
-        else:
-            return False
+        return self.access.is_exempt(message.server, user)
 
-    async def check_filter(self, message):
-        if message.channel.is_private:
-            return
+    async def check_filter(self, route):
+        message = route.message
         server = message.server
         can_delete = message.channel.permissions_for(server.me).manage_messages
 
-        if (message.author.id == self.bot.user.id or
+        if (route.own or
         self.immune_from_filter(message) or not can_delete): # Owner, admins and mods are immune to the filter
             return
 
-        if server.id in self.filter.keys():
-            for w in self.filter[server.id]:
-                if w in message.content.lower():
-                    # Something else in discord.py is throwing a 404 error
-                    # after deletion
-                    try:
-                        await self._delete_message(message)
-                    except:
-                        pass
-                    print("Message deleted. Filtered: " + w)
+        if server.id in self.filters:
+            w = self.filters[server.id].search(message.content)
+            if w is not None:
+                # Something else in discord.py is throwing a 404 error
+                # after deletion
+                try:
+                    await self._delete_message(message)
+                except:
+                    pass
+                print("Message deleted. Filtered: " + w)
+
+    async def forget_roles(self, before, after):
+        if before.roles != after.roles:
+            self.access.forget_member(after.server.id, after.id)
+
+    async def forget_member(self, member):
+        self.access.forget_member(member.server.id, member.id)
+
+    async def forget_server_roles(self, role):
+        self.access.forget_server(role.server.id)
+
+    async def forget_server(self, server):
+        self.access.forget_server(server.id)
 
     async def check_names(self, before, after):
         if before.name != after.name:
+            changed = True
             if before.id not in self.past_names.keys():
                 self.past_names[before.id] = [after.name]
             else:
@@ -471,22 +462,245 @@ class Mod:
                     names = deque(self.past_names[before.id], maxlen=20)
                     names.append(after.name)
                     self.past_names[before.id] = list(names)
-            dataIO.save_json("data/mod/past_names.json", self.past_names)
+                else:
+                    changed = False
+            if changed: # Only real changes go to the journal
+                dataIO.update_json("data/mod/past_names.json",
+                                   self.past_names, before.id)
 
         if before.nick != after.nick and after.nick is not None:
             server = before.server
-            if not server.id in self.past_nicknames:
-                self.past_nicknames[server.id] = {}
-            if before.id in self.past_nicknames[server.id]:
-                nicks = deque(self.past_nicknames[server.id][before.id],
-                              maxlen=20)
+            nicks = self.past_nicknames.get(server.id, before.id)
+            if nicks is not None:
+                nicks = deque(nicks, maxlen=20)
             else:
                 nicks = []
             if after.nick not in nicks:
                 nicks.append(after.nick)
-                self.past_nicknames[server.id][before.id] = list(nicks)
-                dataIO.save_json("data/mod/past_nicknames.json",
-                                 self.past_nicknames)
+                self.past_nicknames.set(server.id, before.id, list(nicks))
+
+class RateLimiter():
+    """Token bucket pacing one kind of request.
+
+    Lets `rate` requests a second through, in bursts of up to `burst`. A
+    429 halves the rate and holds every request until the reset announced
+    by the response's headers, successes then grow it back slowly to
+    twice the starting rate at most"""
+
+    def __init__(self, rate, burst):
+        self.base = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.hold_until = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.hold_until:
+                await asyncio.sleep(self.hold_until - now)
+                continue
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def idle(self):
+        """Back to a full bucket, as if it had never been used"""
+        now = time.monotonic()
+        if now < self.hold_until:
+            return False
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+    def succeeded(self):
+        self.rate = min(self.base * 2, self.rate + self.base / 10)
+
+    def failed(self, error):
+        """Reads the rate limit headers of a failed request. Returns True
+           if it was rate limited, and so is worth retrying"""
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        if "X-RateLimit-Limit" in headers:
+            try:
+                self.burst = max(1, int(headers["X-RateLimit-Limit"]))
+            except ValueError:
+                pass
+        limited = getattr(response, "status", None) == 429
+        if limited:
+            self.rate = max(self.base / 8, self.rate / 2)
+        if limited or headers.get("X-RateLimit-Remaining") == "0":
+            self.tokens = 0
+            self.hold_until = time.monotonic() + _reset_after(headers)
+        return limited
+
+
+class DeletionEngine():
+    """Deletes the messages of a channel's history that pass `check`.
+
+    One task pages through the history, 100 messages a request, while
+    another deletes what it found: messages younger than 14 days in bulk
+    deletes of up to 100, older ones (Discord refuses to bulk delete
+    them) one by one. `limiters` is the (single, bulk) pair of
+    RateLimiters pacing the deletes.
+
+    Goes back from `before`, stopping after `number` matches, or forward
+    from `after`. `scan` caps how many messages are looked at and `extra`
+    messages are deleted too. Messages Discord fails to delete are
+    skipped and counted in `failed`"""
+
+    BULK_MAX = 100
+    BULK_AGE = 14 * 24 * 3600 - 60  # A minute of leeway
+    DISCORD_EPOCH = 1420070400
+    RETRIES = 3
+
+    def __init__(self, bot, channel, limiters, check=None, number=None,
+                 before=None, after=None, scan=None, extra=()):
+        self.bot = bot
+        self.channel = channel
+        self.single_limiter, self.bulk_limiter = limiters
+        self.check = check
+        self.number = number
+        self.before = before
+        self.after = after
+        self.scan = scan
+        self.extra = list(extra)
+        self.bulk = True
+        self.deleted = 0
+        self.failed = 0
+
+    async def run(self):
+        """Returns how many messages were deleted"""
+        queue = asyncio.Queue(maxsize=self.BULK_MAX * 5)
+        for message in self.extra:
+            queue.put_nowait(message)
+        producer = self.bot.loop.create_task(self._produce(queue))
+        try:
+            await self._consume(queue)
+        except BaseException:
+            producer.cancel()
+            raise
+        await producer # Raises what reading the history raised
+        return self.deleted
+
+    async def _produce(self, queue):
+        try:
+            await self._fetch(queue)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await queue.put(None)
+            raise
+        await queue.put(None)
+
+    async def _fetch(self, queue):
+        before, after = self.before, self.after
+        found = scanned = 0
+        while True:
+            page = []
+            async for message in self.bot.logs_from(self.channel, limit=100,
+                                                    before=before,
+                                                    after=after):
+                page.append(message)
+            if not page:
+                return
+            if after is not None:
+                page.sort(key=lambda m: int(m.id))
+                after = page[-1]
+            else:
+                page.sort(key=lambda m: int(m.id), reverse=True)
+                before = page[-1]
+            for message in page:
+                if self.check is None or self.check(message):
+                    await queue.put(message)
+                    found += 1
+                    if found == self.number:
+                        return
+            scanned += len(page)
+            if len(page) < 100 or (self.scan and scanned >= self.scan):
+                return
+
+    async def _consume(self, queue):
+        batch = []
+        while True:
+            if batch and queue.empty(): # Don't wait for the next page
+                await self._delete_bulk(batch)
+                batch = []
+            message = await queue.get()
+            if message is None:
+                break
+            if self.bulk and self._bulk_deletable(message):
+                batch.append(message)
+                if len(batch) == self.BULK_MAX:
+                    await self._delete_bulk(batch)
+                    batch = []
+            else:
+                await self._delete_single(message)
+        if batch:
+            await self._delete_bulk(batch)
+
+    def _bulk_deletable(self, message):
+        created = (int(message.id) >> 22) / 1000 + self.DISCORD_EPOCH
+        return time.time() - created < self.BULK_AGE
+
+    async def _delete_bulk(self, batch):
+        if len(batch) == 1:
+            await self._delete_single(batch[0])
+            return
+        for attempt in range(self.RETRIES):
+            await self.bulk_limiter.acquire()
+            try:
+                await self.bot.delete_messages(batch)
+            except discord.errors.Forbidden:
+                raise
+            except discord.errors.HTTPException as e:
+                if self.bulk_limiter.failed(e) and attempt + 1 < self.RETRIES:
+                    continue
+                break # Some were already deleted, or they're too old
+            self.bulk_limiter.succeeded()
+            self.deleted += len(batch)
+            return
+        for message in batch:
+            await self._delete_single(message)
+
+    async def _delete_single(self, message):
+        for attempt in range(self.RETRIES):
+            await self.single_limiter.acquire()
+            try:
+                await self.bot.delete_message(message)
+            except discord.errors.NotFound:
+                return
+            except discord.errors.Forbidden:
+                raise
+            except discord.errors.HTTPException as e:
+                if self.single_limiter.failed(e) and attempt + 1 < self.RETRIES:
+                    continue
+                logger.warning("Couldn't delete message {} in channel {}: "
+                               "{}".format(message.id, self.channel.id, e))
+                self.failed += 1
+                return
+            self.single_limiter.succeeded()
+            self.deleted += 1
+            return
+
+
+def _reset_after(headers):
+    """Seconds until the rate limit resets, 1 if the headers don't say"""
+    try:
+        if "X-RateLimit-Reset-After" in headers:
+            return float(headers["X-RateLimit-Reset-After"])
+        if "Retry-After" in headers:
+            retry = float(headers["Retry-After"])
+            return retry / 1000 if retry > 60 else retry # ms on API v6
+        if "X-RateLimit-Reset" in headers:
+            return max(0, float(headers["X-RateLimit-Reset"]) - time.time())
+    except ValueError:
+        pass
+    return 1
+
 
 def check_folders():
     folders = ("data", "data/mod/")
@@ -515,14 +729,14 @@ def check_files():
         print("Creating empty filter.json...")
         fileIO("data/mod/filter.json", "save", {})
 
+    if not os.path.isfile("data/mod/filter_options.json"):
+        print("Creating empty filter_options.json...")
+        fileIO("data/mod/filter_options.json", "save", {})
+
     if not os.path.isfile("data/mod/past_names.json"):
         print("Creating empty past_names.json...")
         fileIO("data/mod/past_names.json", "save", {})
 
-    if not os.path.isfile("data/mod/past_nicknames.json"):
-        print("Creating empty past_nicknames.json...")
-        fileIO("data/mod/past_nicknames.json", "save", {})
-
 
 
 def setup(bot):
@@ -539,6 +753,9 @@ def setup(bot):
             logging.Formatter('%(asctime)s %(message)s', datefmt="[%d/%m/%Y %H:%M]"))
         logger.addHandler(handler)
     n = Mod(bot)
-    bot.add_listener(n.check_filter, "on_message")
     bot.add_listener(n.check_names, "on_member_update")
+    bot.add_listener(n.forget_roles, "on_member_update")
+    bot.add_listener(n.forget_member, "on_member_remove")
+    bot.add_listener(n.forget_server_roles, "on_server_role_delete")
+    bot.add_listener(n.forget_server, "on_server_remove")
     bot.add_cog(n)
@@ -1,10 +1,14 @@
 import discord
 from discord.ext import commands
 from cogs.utils import checks
-from __main__ import set_cog, send_cmd_help, settings
-from .utils.dataIO import fileIO
+from __main__ import set_cog, send_cmd_help, settings, lag_monitor, router
+from .utils.dataIO import fileIO, dataIO
+from .utils.chat_formatting import box
+from .utils.channellog import SegmentWriter, FLAG_EDIT, timestamp
+from .utils import channellog
 
 import importlib
+import atexit
 import traceback
 import logging
 import asyncio
@@ -14,7 +18,8 @@ import glob
 import os
 import time
 import aiohttp
-import copy
+import io
+import re
 
 log = logging.getLogger("simbad.owner")
 
@@ -49,10 +54,18 @@ class Owner:
         self.setowner_lock = False
         self.disabled_commands = fileIO("data/simbad/disabled_commands.json", "load")
         self.channels = fileIO("data/channellogger/channels.json", "load")
+        for channel_id, enabled in self.channels.items():
+            if enabled:
+                router.listen(self.message_logger, channel=channel_id)
+        self.log_writer = SegmentWriter()
+        self.log_writer.start()
+        atexit.register(self.log_writer.close) # Logs still queued at exit
         self.session = aiohttp.ClientSession(loop=self.bot.loop)
 
     def __unload(self):
         self.session.close()
+        atexit.unregister(self.log_writer.close)
+        self.log_writer.close()
 
     @commands.command()
     @checks.is_owner()
@@ -273,9 +286,10 @@ class Owner:
         if len(token) < 50:
             await self.bot.say("Invalid token.")
         else:
-            settings.login_type = "token"
-            settings.email = token
-            settings.password = ""
+            with settings.batch():
+                settings.login_type = "token"
+                settings.email = token
+                settings.password = ""
             await self.bot.say("Token set. Restart me.")
             log.debug("Just converted to a bot account.")
 
@@ -322,6 +336,32 @@ class Owner:
         up = str(datetime.timedelta(seconds=up))
         await self.bot.say("`Uptime: {}`".format(up))
 
+    @commands.command()
+    @checks.is_owner()
+    async def lag(self):
+        """Shows event loop stalls and what caused them"""
+        stalls = lag_monitor.stalls
+        if not stalls:
+            await self.bot.say("No stall over {}ms so far.".format(
+                int(lag_monitor.threshold * 1000)))
+            return
+        worst = max(s[1] for s in stalls)
+        msg = "{} stalls over {}ms, worst {:.2f}s\n\n".format(
+            len(stalls), int(lag_monitor.threshold * 1000), worst)
+        for bound, count in lag_monitor.histogram():
+            if bound is None:
+                label = "longer"
+            else:
+                label = "<= {}s".format(bound)
+            msg += "{:<10}{:>6} {}\n".format(label, count,
+                                             "#" * min(count, 30))
+        msg += "\n{:<30}{:>7}{:>9}{:>8}\n".format("Culprit", "Stalls",
+                                                 "Total", "Worst")
+        for culprit, count, total, worst, where in lag_monitor.offenders():
+            msg += "{:<30}{:>7}{:>8.2f}s{:>7.2f}s\n".format(
+                culprit[:29], count, total, worst)
+        await self.bot.say(box(msg))
+
     def _load_cog(self, cogname):
         if not self._does_cogfile_exist(cogname):
             raise CogNotFoundError(cogname)
@@ -333,6 +373,7 @@ class Owner:
             raise CogLoadError(*e.args)
         except:
             raise
+        self.bot.dispatch("cog_loaded", cogname)
 
     def _unload_cog(self, cogname, reloading=False):
         if not reloading and cogname == "cogs.owner":
@@ -342,6 +383,12 @@ class Owner:
             self.bot.unload_extension(cogname)
         except:
             raise CogUnloadError
+        else:
+            # Only once it's gone, a cog still loaded keeps its listeners
+            router.remove_module(cogname)
+            self.bot.dispatch("cog_unloaded", cogname)
+        finally:
+            dataIO.flush() # Nothing the cog saved should be left pending
 
     def _list_cogs(self):
         cogs = glob.glob("cogs/*.py")
@@ -394,40 +441,144 @@ class Owner:
         else:
             self.channels[channel.id] = not self.channels[channel.id]
         if self.channels[channel.id]:
+            router.listen(self.message_logger, channel=channel.id)
             await self.bot.say('Logging enabled'
                                ' for {}'.format(channel.mention))
         else:
+            router.unlisten(self.message_logger, channel=channel.id)
             await self.bot.say('Logging disabled'
                                ' for {}'.format(channel.mention))
         self.save_channels()
 
+    @commands.command(pass_context=True)
+    @checks.is_owner()
+    async def logsearch(self, ctx, channel: discord.Channel, since: str,
+                        until: str="now", user: str=None):
+        """Searches the logs of a logged channel
+
+        since and until are UTC times like 2017-05-21 or 2017-05-21T18:30,
+        or how long ago like 3d, 12h or 45m. user is a mention or an id.
+        The results are uploaded as text files. Logs from before the
+        current format are only found after a logconvert"""
+        start = self._parse_when(since)
+        end = self._parse_when(until)
+        author = None
+        if user is not None:
+            try:
+                author = int(user.strip("<@!>"))
+            except ValueError:
+                pass
+        if start is None or end is None or (user is not None and
+                                            author is None):
+            await send_cmd_help(ctx)
+            return
+        fname = 'data/channellogger/{}/{}.seg'.format(channel.server.id,
+                                                      channel.id)
+        names = {m.id: str(m) for m in channel.server.members}
+        results = channellog.query(fname, start, end, author)
+        pages = 0
+        try:
+            while True:
+                page = await self.bot.loop.run_in_executor(
+                    None, self._log_page, results, names)
+                if page is None:
+                    break
+                pages += 1
+                await self.bot.upload(io.BytesIO(page),
+                                      filename="{}-{}.txt".format(
+                                          channel.name, pages))
+                if pages == 10:
+                    await self.bot.say("That's enough files, try a narrower "
+                                       "search.")
+                    break
+        finally:
+            results.close() # Closes the segment it was reading
+        if not pages:
+            await self.bot.say("Nothing found.")
+
+    @commands.command(pass_context=True)
+    @checks.is_owner()
+    async def logconvert(self, ctx):
+        """Imports the old text channel logs so logsearch finds them
+
+        Authors are matched by name#discriminator with the members of the
+        server now, the .log files are left as they are"""
+        converted = records = 0
+        logs = set() # Channels with only rotated parts left too
+        for fname in glob.glob("data/channellogger/*/*.log*"):
+            logs.add(fname[:fname.index(".log") + 4])
+        for fname in sorted(logs):
+            server_id = os.path.basename(os.path.dirname(fname))
+            channel_id = os.path.splitext(os.path.basename(fname))[0]
+            if not channel_id.isdigit():
+                continue
+            server = self.bot.get_server(server_id)
+            authors = {}
+            if server is not None:
+                authors = {str(m): int(m.id) for m in server.members}
+            segment = os.path.splitext(fname)[0] + ".seg"
+            count = await self.bot.loop.run_in_executor(
+                None, channellog.convert_text_log, fname, segment,
+                int(channel_id), authors)
+            if count is not None:
+                converted += 1
+                records += count
+        await self.bot.say("Converted {} logs, {} messages.".format(
+            converted, records))
+
+    def _parse_when(self, text):
+        if text == "now":
+            return time.time()
+        ago = re.fullmatch(r"(\d+)([dhm])", text)
+        if ago:
+            seconds = {"d": 86400, "h": 3600, "m": 60}[ago.group(2)]
+            return time.time() - int(ago.group(1)) * seconds
+        for fmt in ("%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S"):
+            try:
+                return timestamp(datetime.datetime.strptime(text, fmt))
+            except ValueError:
+                pass
+        return None
+
+    def _log_page(self, results, names, size=1024 * 1024):
+        """Renders the next `size` bytes of results, None when done. Runs
+           in an executor"""
+        page = []
+        length = 0
+        for ts, author, channel, flags, content in results:
+            when = datetime.datetime.utcfromtimestamp(ts)
+            line = "[{:%Y-%m-%d %H:%M:%S}] {}{} ({}): {}\n".format(
+                when, "EDIT " if flags & FLAG_EDIT else "",
+                names.get(str(author), "?"), author, content)
+            line = line.encode("utf-8")
+            page.append(line)
+            length += len(line)
+            if length >= size:
+                break
+        return b"".join(page) if page else None
+
     def save_channels(self):
         fileIO('data/channellogger/channels.json', 'save', self.channels)
 
-    def log(self, message):
-        serverid = message.server.id
-        channelid = message.channel.id
-        if not os.path.exists('data/channellogger/{}'.format(serverid)):
-            os.mkdir('data/channellogger/{}'.format(serverid))
-        fname = 'data/channellogger/{}/{}.log'.format(serverid, channelid)
-        with open(fname, 'a', errors='backslashreplace') as f:
-            message = ("{0.timestamp} #{1.name} @{2.name}#{2.discriminator}: "
-                       "{0.clean_content}\n".format(message, message.channel,
-                                                    message.author))
-            f.write(message)
-
-    async def message_logger(self, message):
-        enabled = self.channels.get(message.channel.id, False)
-        if enabled:
-            self.log(message)
+    def log(self, message, content=None, flags=0, when=None):
+        fname = 'data/channellogger/{}/{}.seg'.format(message.server.id,
+                                                      message.channel.id)
+        if content is None:
+            content = message.clean_content
+        self.log_writer.write(fname, (timestamp(when or message.timestamp),
+                                      int(message.author.id),
+                                      int(message.channel.id), flags,
+                                      content))
+
+    async def message_logger(self, route):
+        self.log(route.message)
 
     async def message_edit_logger(self, before, after):
-        new_message = copy.deepcopy(after)
-        new_content = ("EDIT: \nBefore: "
-                       "{}\nAfter: {}".format(before.clean_content,
-                                              after.clean_content))
-        new_message.content = new_content
-        await self.message_logger(new_message)
+        if not self.channels.get(after.channel.id, False):
+            return
+        content = "Before: {}\nAfter: {}".format(before.clean_content,
+                                                after.clean_content)
+        self.log(after, content, FLAG_EDIT, after.edited_timestamp)
 
 def check_folders():
     if not os.path.exists("data/channellogger"):
@@ -445,5 +596,4 @@ def setup(bot):
     check_files()
     n = Owner(bot)
     bot.add_cog(n)
-    bot.add_listener(n.message_logger, "on_message")
     bot.add_listener(n.message_edit_logger, 'on_message_edit')
@@ -1,10 +1,10 @@
 import discord
 from discord.ext import commands
-from cogs.utils.dataIO import dataIO, fileIO
+from cogs.utils.dataIO import fileIO
+from cogs.utils.sqlstore import KeyedStore, LEGACY
 from collections import namedtuple, defaultdict
 from datetime import datetime
 from random import randint
-from copy import deepcopy
 from .utils import checks
 from __main__ import send_cmd_help
 import os
@@ -32,16 +32,16 @@ class SameSenderAndReceiver(AccountError):
 
 class Accounts:
     def __init__(self, bot):
-        self.accounts = dataIO.load_json("data/fakin/profile.json")
+        self.accounts = KeyedStore("data/fakin/profile.db", "profile")
+        self.accounts.migrate_json("data/fakin/profile.json")
         self.bot = bot
 
     def create_account(self, user):
         server = user.server
         if not self.account_exists(user):
-            if server.id not in self.accounts:
-                self.accounts[server.id] = {}
-            if user.id in self.accounts: # Legacy account
-                assets = self.accounts[user.id]["assets"]
+            legacy = self.accounts.get(LEGACY, user.id)
+            if legacy is not None: # Legacy account
+                assets = legacy["assets"]
             else:
                 assets = 0
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -50,9 +50,7 @@ class Accounts:
                        "explore":"_____","location":"____",
                        "ships": "None",
                         "created_at" : timestamp}
-            self.accounts[server.id][user.id] = account
-
-            self._save_profile()
+            self.accounts.set(server.id, user.id, account)
             return self.get_account(user)
         else:
             raise AccountAlreadyExists
@@ -65,113 +63,81 @@ class Accounts:
         return True
 
     def set_credits(self, user, amount):
-        server = user.server
         if amount < 0:
             raise NegativeValue
         account = self._get_account(user)
         account["assets"] = amount
-        self.accounts[server.id][user.id] = account
-        self._save_profile()
+        self._save_account(user, account)
 
     def set_ships(self,user,ship):
-        server = user.server
         account = self._get_account(user)
         account["ships"] = ship
-        self.accounts[server.id][user.id] = account
-        self._save_profile()
+        self._save_account(user, account)
 
     def set_cmdr(self, user, cmdrname):
-        server = user.server
         account = self._get_account(user)
         account["cmdr"] = cmdrname
-        self.accounts[server.id][user.id] = account
-        self._save_profile()
+        self._save_account(user, account)
 
     def set_combat(self,user,combat):
-        server = user.server
         account = self._get_account(user)
         account["combat"] = combat
-        self.accounts[server.id][user.id] = account
-        self._save_profile()
+        self._save_account(user, account)
 
     def set_trade(self,user,trade):
-        server = user.server
         account = self._get_account(user)
         account["trade"] = trade
-        self.accounts[server.id][user.id] = account
-        self._save_profile()
+        self._save_account(user, account)
 
     def set_explore(self,user,explore):
-        server = user.server
         account = self._get_account(user)
         account["explore"] = explore
-        self.accounts[server.id][user.id] = account
-        self._save_profile()
+        self._save_account(user, account)
 
     def set_location(self,user,location):
-        server = user.server
         account = self._get_account(user)
         account["location"] = location
-        self.accounts[server.id][user.id] = account
-        self._save_profile()
+        self._save_account(user, account)
 
     def set_powerplay(self, user, powerplay):
-        server = user.server
         account = self._get_account(user)
         account["powerplay"] = powerplay
-        self.accounts[server.id][user.id] = account
-        self._save_profile()
+        self._save_account(user, account)
 
     def set_superpower(self,user,superpower):
-        server = user.server
         account = self._get_account(user)
         account["superpower"] = superpower
-        self.accounts[server.id][user.id] = account
-        self._save_profile()
+        self._save_account(user, account)
 
     def set_fedrank(self,user,fedrank):
-        server = user.server
         account = self._get_account(user)
         account["fedrank"] = fedrank
-        self.accounts[server.id][user.id] = account
-        self._save_profile()
+        self._save_account(user, account)
 
     def set_emprank(self,user,emprank):
-        server = user.server
         account = self._get_account(user)
         account["emprank"] = emprank
-        self.accounts[server.id][user.id] = account
-        self._save_profile()
+        self._save_account(user, account)
 
     def wipe_profile(self, server):
-        self.accounts[server.id] = {}
-        self._save_profile()
+        self.accounts.delete_server(server.id)
 
     def get_server_accounts(self, server):
-        if server.id in self.accounts:
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            accounts = []
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
-            return accounts
-        else:
-            return []
+        accounts = []
+        for k, v in self.accounts.server_items(server.id):
+            v["id"] = k
+            v["server"] = server
+            acc = self._create_account_obj(v)
+            accounts.append(acc)
+        return accounts
 
     def get_all_accounts(self):
         accounts = []
-        for server_id, v in self.accounts.items():
+        for server_id in self.accounts.servers():
             server = self.bot.get_server(server_id)
             if server is None:# Servers that have since been left will be ignored
-                continue      # Same for users_id from the old profile format
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
+                continue
+            accounts.extend(self.get_server_accounts(server))
         return accounts
 
     def get_assets(self, user):
@@ -250,15 +216,14 @@ class Accounts:
             created_at = datetime.strptime(account["created_at"], "%Y-%m-%d %H:%M:%S"),
             server = account["server"],)
 
-    def _save_profile(self):
-        dataIO.save_json("data/fakin/profile.json", self.accounts)
+    def _save_account(self, user, account):
+        self.accounts.set(user.server.id, user.id, account)
 
     def _get_account(self, user):
-        server = user.server
-        try:
-            return deepcopy(self.accounts[server.id][user.id])
-        except KeyError:
+        account = self.accounts.get(user.server.id, user.id)
+        if account is None:
             raise NoAccount
+        return account
 
 class Profile:
     """Profile
@@ -277,6 +242,9 @@ class Profile:
         self.payday_register = defaultdict(dict)
         self.slot_register = defaultdict(dict)
 
+    def __unload(self):
+        self.profile.accounts.close()
+
     @commands.group(name="profile", pass_context=True)
     async def _profile(self, ctx):
         """Accounts operations"""
@@ -742,10 +710,6 @@ def check_files():
         print("Creating default economy's settings.json...")
         fileIO(f, "save", {})
 
-    f = "data/fakin/profile.json"
-    if not fileIO(f, "check"):
-        print("Creating empty profile.json...")
-        fileIO(f, "save", {})
 
 def setup(bot):
     global logger
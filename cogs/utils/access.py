@@ -0,0 +1,62 @@
+class AccessIndex():
+    """Who may use the bot, kept in hash sets for user_allowed.
+
+    Mirrors Mod's blacklist, whitelist and ignore lists and caches the role
+    ids of every member seen, so checking a message costs a few set
+    lookups and allocates nothing once its author is cached. The owner of
+    the index has to keep it updated: the sets when the lists change and
+    the role cache on member and role events"""
+
+    def __init__(self, settings, blacklist=(), whitelist=(),
+                 ignored_servers=(), ignored_channels=()):
+        self.settings = settings
+        self.blacklist = set(blacklist)
+        self.whitelist = set(whitelist)
+        self.ignored_servers = set(ignored_servers)
+        self.ignored_channels = set(ignored_channels)
+        self._roles = {}  # server id : {member id : frozenset of role ids}
+
+    def allowed(self, message):
+        author = message.author
+        if author.id == self.settings.owner:
+            return True
+        private = message.channel.is_private
+        if not private and self.is_exempt(message.server, author):
+            return True
+        if author.id in self.blacklist:
+            return False
+        if self.whitelist and author.id not in self.whitelist:
+            return False
+        if not private:
+            if message.server.id in self.ignored_servers:
+                return False
+            if message.channel.id in self.ignored_channels:
+                return False
+        return True
+
+    def is_exempt(self, server, member):
+        """Has the server's admin or mod role, see ServerView.exempt_ids"""
+        exempt = self.settings.server_view(server).exempt_ids
+        if not exempt:
+            return False
+        return not exempt.isdisjoint(self.role_ids(server.id, member))
+
+    def role_ids(self, server_id, member):
+        members = self._roles.get(server_id)
+        if members is None:
+            members = self._roles[server_id] = {}
+        roles = members.get(member.id)
+        if roles is None:
+            roles = frozenset(r.id for r in getattr(member, "roles", ()))
+            members[member.id] = roles
+        return roles
+
+    def forget_member(self, server_id, member_id):
+        """Call when the member's roles changed or they left"""
+        members = self._roles.get(server_id)
+        if members is not None:
+            members.pop(member_id, None)
+
+    def forget_server(self, server_id):
+        """Call when a role was deleted or the bot left the server"""
+        self._roles.pop(server_id, None)
@@ -0,0 +1,322 @@
+import bisect
+import calendar
+import glob
+import gzip
+import marshal
+import os
+import re
+import struct
+from array import array
+from datetime import datetime
+from .logwriter import LogWriter
+
+# Segment records: timestamp, author id, channel id, flags, content length,
+# then the utf-8 content
+RECORD = struct.Struct("<dQQBI")
+FLAG_EDIT = 1
+INDEX_EVERY = 65536  # Bytes between two entries of the time index
+SLACK = 60  # Seconds records can be out of order by
+# Suffix of the segment imported from the old text logs, sorts before the
+# rotated segments' timestamps
+CONVERTED = "00000000-000000"
+# A line of the old text logs: timestamp #channel @name#discriminator: text
+TEXT_LINE = re.compile(r"(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?) "
+                       r"#\S* @(.*?#\d{4}): (.*)")
+
+
+def timestamp(dt):
+    """Seconds since the epoch of a naive UTC datetime, like discord.py's"""
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1000000
+
+
+class SegmentIndex():
+    """Where to seek in a segment: a sparse time index with the timestamp
+       of one record every INDEX_EVERY bytes, and every author's record
+       offsets. Saved next to the segment as <segment>.idx"""
+
+    def __init__(self):
+        self.size = 0  # Bytes of the segment indexed
+        self.first = None
+        self.last = None
+        self.times = array("d")
+        self.offsets = array("Q")
+        self.authors = {}  # author id : array of offsets
+        self.dirty = False
+
+    def add(self, offset, ts, author):
+        if not self.offsets or offset >= self.offsets[-1] + INDEX_EVERY:
+            self.times.append(ts)
+            self.offsets.append(offset)
+        postings = self.authors.get(author)
+        if postings is None:
+            postings = self.authors[author] = array("Q")
+        postings.append(offset)
+        if self.first is None or ts < self.first:
+            self.first = ts
+        if self.last is None or ts > self.last:
+            self.last = ts
+        self.dirty = True
+
+    def seek(self, start):
+        """Offset to read from for the records since start"""
+        if start is None or not self.times:
+            return 0
+        i = bisect.bisect_left(self.times, start - SLACK)
+        return self.offsets[max(i - 1, 0)]
+
+    def dump(self, path):
+        data = {"size": self.size, "first": self.first, "last": self.last,
+                "times": self.times.tobytes(),
+                "offsets": self.offsets.tobytes(),
+                "authors": {a: p.tobytes() for a, p in self.authors.items()}}
+        tmp_file = path + ".tmp"
+        with open(tmp_file, "wb") as f:
+            marshal.dump(data, f)
+        os.replace(tmp_file, path)
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path, segment, live=True):
+        """The index of segment, rebuilt from it if path is missing or
+           broken. A live segment's index is completed with what was
+           written since it was saved"""
+        index = cls()
+        try:
+            with open(path, "rb") as f:
+                data = marshal.load(f)
+            index.size = data["size"]
+            index.first, index.last = data["first"], data["last"]
+            index.times.frombytes(data["times"])
+            index.offsets.frombytes(data["offsets"])
+            for author, postings in data["authors"].items():
+                index.authors[author] = array("Q", postings)
+        except (OSError, EOFError, ValueError, TypeError, KeyError):
+            index = cls()
+        else:
+            if not live:
+                return index
+        f = _open_segment(segment)
+        if f is not None:
+            with f:
+                index.scan(f)
+        return index
+
+    def scan(self, f):
+        for offset, end, ts, author, _, _, _ in _records(f, self.size):
+            self.add(offset, ts, author)
+            self.size = end
+
+
+class SegmentWriter(LogWriter):
+    """LogWriter of channel log segments, write() takes
+       (timestamp, author id, channel id, flags, content) records. Keeps
+       the segments' indexes up to date, they're saved along the fsyncs.
+       Rotated segments aren't compressed by default: their indexes are
+       byte offsets, which a gzip file can only reach by decompressing
+       everything before them"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("compress", False)
+        super().__init__(**kwargs)
+        self._indexes = {}  # segment : SegmentIndex, open segments only
+
+    def _encode(self, record):
+        ts, author, channel, flags, content = record
+        content = content.encode("utf-8", "backslashreplace")
+        return RECORD.pack(ts, author, channel, flags, len(content)) + content
+
+    def _index(self, path):
+        index = self._indexes.get(path)
+        if index is None:
+            index = SegmentIndex.load(path + ".idx", path)
+            self._indexes[path] = index
+        return index
+
+    def _appended(self, handle, offset, chunks):
+        index = self._index(handle.path)
+        if index.size < offset: # Written to by someone else
+            with open(handle.path, "rb") as f:
+                index.scan(f)
+        for chunk in chunks:
+            if offset >= index.size: # Not loaded with the index already
+                ts, author = RECORD.unpack_from(chunk)[:2]
+                index.add(offset, ts, author)
+            offset += len(chunk)
+        index.size = max(index.size, offset)
+
+    def _fsync(self):
+        super()._fsync()
+        for path, index in self._indexes.items():
+            if index.dirty:
+                index.dump(path + ".idx")
+
+    def _closing(self, handle):
+        index = self._indexes.pop(handle.path, None)
+        if index is not None and index.dirty:
+            index.dump(handle.path + ".idx")
+
+    def _rotating(self, path, rotated):
+        index = SegmentIndex.load(path + ".idx", path)
+        if index.dirty: # Left behind by a crash
+            index.dump(path + ".idx")
+        if os.path.isfile(path + ".idx"):
+            os.replace(path + ".idx", rotated + ".idx")
+
+
+def convert_text_log(path, segment, channel_id, authors):
+    """One-time import of a channel's old text log, path and its rotated
+       parts, as a segment older than the others of segment. authors maps
+       name#discriminator to user ids, unknown authors get 0. Returns how
+       many records were imported, None if it was done already"""
+    target = "{}.{}".format(segment, CONVERTED)
+    if os.path.isfile(target):
+        return None
+    tmp_file = target + ".tmp"
+    index = SegmentIndex()
+    offset = count = 0
+    with open(tmp_file, "wb") as out:
+        for ts, author, flags, content in _text_records(path, authors):
+            content = content.encode("utf-8", "backslashreplace")
+            out.write(RECORD.pack(ts, author, channel_id, flags, len(content)))
+            out.write(content)
+            index.add(offset, ts, author)
+            offset += RECORD.size + len(content)
+            count += 1
+    index.size = offset
+    index.dump(target + ".idx")
+    os.replace(tmp_file, target)
+    return count
+
+
+def _text_records(path, authors):
+    record = None
+    for part in segments(path):
+        f = _open_segment(part)
+        if f is None:
+            continue
+        with f:
+            for line in f:
+                line = line.decode("utf-8", "replace").rstrip("\n")
+                match = TEXT_LINE.fullmatch(line)
+                if match is None:
+                    if record is not None: # Multiline message
+                        record[3] += "\n" + line
+                    continue
+                if record is not None:
+                    yield _finish(record)
+                when, name, content = match.groups()
+                fmt = "%Y-%m-%d %H:%M:%S.%f" if "." in when else \
+                      "%Y-%m-%d %H:%M:%S"
+                flags = 0
+                if content.startswith("EDIT:"):
+                    flags, content = FLAG_EDIT, content[5:].strip()
+                record = [timestamp(datetime.strptime(when, fmt)),
+                          authors.get(name, 0), flags, content]
+    if record is not None:
+        yield _finish(record)
+
+
+def _finish(record):
+    ts, author, flags, content = record
+    if flags & FLAG_EDIT:
+        content = content.lstrip("\n")
+    return ts, author, flags, content
+
+
+def segments(path):
+    """The segments of a channel's log, oldest first, the live one last"""
+    rotated = set()
+    for name in glob.glob(glob.escape(path) + ".*"):
+        if name.endswith((".idx", ".tmp")):
+            continue
+        rotated.add(name[:-3] if name.endswith(".gz") else name)
+    found = sorted(rotated)
+    if os.path.isfile(path):
+        found.append(path)
+    return found
+
+
+def query(path, start=None, end=None, author=None):
+    """Yields the records (timestamp, author id, channel id, flags,
+       content) of a channel's log between start and end, from author if
+       given. Segments and records are found through the indexes, only
+       the matching ones are read"""
+    for segment in segments(path):
+        index = SegmentIndex.load(segment + ".idx", segment,
+                                  live=segment == path)
+        if index.first is None:
+            continue
+        if start is not None and index.last < start - SLACK:
+            continue
+        if end is not None and index.first > end + SLACK:
+            continue
+        f = _open_segment(segment)
+        if f is None:
+            continue
+        with f:
+            yield from _read(f, index, start, end, author)
+
+
+def _read(f, index, start, end, author):
+    begin = index.seek(start)
+    if author is not None:
+        postings = index.authors.get(author, ())
+        i = bisect.bisect_left(postings, begin)
+        for offset in postings[i:]:
+            f.seek(offset)
+            record = _record(f)
+            if record is None:
+                return
+            if end is not None and record[0] > end + SLACK:
+                return
+            if _in_range(record[0], start, end):
+                yield record
+        return
+    for _, _, ts, author, channel, flags, content in _records(f, begin):
+        if end is not None and ts > end + SLACK:
+            return
+        if _in_range(ts, start, end):
+            yield (ts, author, channel, flags,
+                   content.decode("utf-8", "replace"))
+
+
+def _in_range(ts, start, end):
+    return (start is None or ts >= start) and (end is None or ts <= end)
+
+
+def _open_segment(segment):
+    try:
+        return open(segment, "rb")
+    except FileNotFoundError: # Compressed by an older version, slow seeks
+        try:
+            return gzip.open(segment + ".gz", "rb")
+        except FileNotFoundError:
+            return None
+
+
+def _record(f):
+    head = f.read(RECORD.size)
+    if len(head) < RECORD.size:
+        return None
+    ts, author, channel, flags, length = RECORD.unpack(head)
+    content = f.read(length)
+    if len(content) < length:
+        return None # Still being written
+    return (ts, author, channel, flags, content.decode("utf-8", "replace"))
+
+
+def _records(f, offset=0):
+    """Yields (offset, end offset, timestamp, author id, channel id, flags,
+       encoded content) from offset to the last complete record"""
+    f.seek(offset)
+    while True:
+        head = f.read(RECORD.size)
+        if len(head) < RECORD.size:
+            return
+        ts, author, channel, flags, length = RECORD.unpack(head)
+        content = f.read(length)
+        if len(content) < length:
+            return
+        end = offset + RECORD.size + length
+        yield offset, end, ts, author, channel, flags, content
+        offset = end
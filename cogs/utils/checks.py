@@ -1,6 +1,6 @@
 from discord.ext import commands
 import discord.utils
-from cogs.utils.settings import Settings
+from cogs.utils.settings import Settings, ServerView
 from cogs.utils.dataIO import fileIO
 from __main__ import settings
 
@@ -37,6 +37,7 @@ def check_permissions(ctx, perms):
     return all(getattr(resolved, name, None) == value for name, value in perms.items())
 
 def role_or_permissions(ctx, check, **perms):
+    """check is either a predicate on roles or a set of role ids"""
     if check_permissions(ctx, perms):
         return True
 
@@ -45,32 +46,29 @@ def role_or_permissions(ctx, check, **perms):
     if ch.is_private:
         return False # can't have roles in PMs
 
+    if isinstance(check, (set, frozenset)):
+        return ServerView.has_any_role(author, check)
     role = discord.utils.find(check, author.roles)
     return role is not None
 
 def recruiter_or_permissions(**perms):
     def predicate(ctx):
-        server = ctx.message.server
-        recruiter_role = settings.get_server_recruiter(server).lower()
-        return role_or_permissions(ctx, lambda r: r.name.lower() == recruiter_role, **perms)
+        view = settings.server_view(ctx.message.server)
+        return role_or_permissions(ctx, view.recruiter_ids, **perms)
 
     return commands.check(predicate)
 
 def mod_or_permissions(**perms):
     def predicate(ctx):
-        server = ctx.message.server
-        recruiter_role = settings.get_server_recruiter(server).lower()
-        mod_role = settings.get_server_mod(server).lower()
-        admin_role = settings.get_server_admin(server).lower()
-        return role_or_permissions(ctx, lambda r: r.name.lower() in (recruiter_role,mod_role,admin_role), **perms)
+        view = settings.server_view(ctx.message.server)
+        return role_or_permissions(ctx, view.staff_ids, **perms)
 
     return commands.check(predicate)
 
 def admin_or_permissions(**perms):
     def predicate(ctx):
-        server = ctx.message.server
-        admin_role = settings.get_server_admin(server)
-        return role_or_permissions(ctx, lambda r: r.name.lower() == admin_role.lower(), **perms)
+        view = settings.server_view(ctx.message.server)
+        return role_or_permissions(ctx, view.admin_ids, **perms)
 
     return commands.check(predicate)
 
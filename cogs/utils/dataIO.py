@@ -1,6 +1,16 @@
 import json
+import io
 import os
+import asyncio
 import logging
+import marshal
+import pickle
+import threading
+import itertools
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 from shutil import copy
 
 class InvalidFileIO(Exception):
@@ -9,55 +19,643 @@ class InvalidFileIO(Exception):
 class CorruptedJSON(Exception):
     pass
 
+FORMATS = ("pretty", "compact", "binary")
+# Binary files: magic, payload length, payload crc32, payload. The last
+# byte of the magic is the payload's version: 1 was marshal, which can
+# change between Python versions and is only read now, 2 is pickle at a
+# pinned protocol. Payloads only ever hold plain json types and are read
+# back with PlainUnpickler, so a planted file can't run code on load
+BINARY_PREFIX = b"SIMBAD\x00"
+BINARY_MAGIC = BINARY_PREFIX + b"\x02"
+BINARY_MARSHAL = BINARY_PREFIX + b"\x01"
+BINARY_HEADER = struct.Struct("<8sII")
+PICKLE_PROTOCOL = 4
+
+JSON_SCALARS = (str, int, float, bool, type(None))
+
+def is_plain(data):
+    """True if data only has the exact types json.loads gives back"""
+    kind = type(data)
+    if kind is dict:
+        return all(type(k) is str and is_plain(v) for k, v in data.items())
+    elif kind is list:
+        return all(is_plain(v) for v in data)
+    return kind in JSON_SCALARS
+
+def plain(data):
+    """data as json would load it back: subclasses become dicts and lists,
+       tuples become lists, keys become strings"""
+    if is_plain(data):
+        return data
+    return json.loads(json.dumps(data))
+
+class PlainUnpickler(pickle.Unpickler):
+    """Loads pickles of plain json types only. Anything naming a class or
+       function, which is how a pickle runs code, is refused"""
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError("{}.{} isn't allowed in a data "
+                                     "file".format(module, name))
+
+def freeze(data):
+    """Read-only view of json data. Dicts become mapping proxies and lists
+       become tuples"""
+    if isinstance(data, dict):
+        return MappingProxyType({k: freeze(v) for k, v in data.items()})
+    elif isinstance(data, list):
+        return tuple(freeze(v) for v in data)
+    return data
+
+class ParsedFile():
+    """Content of a json file as of one (mtime, size). Loads get their own
+       copy, made from a marshal blob which is quicker than parsing"""
+    __slots__ = ("key", "blob", "_frozen")
+
+    def __init__(self, key, data):
+        self.key = key
+        self.blob = marshal.dumps(data)
+        self._frozen = None
+
+    def copy(self):
+        return marshal.loads(self.blob)
+
+    def frozen(self):
+        if self._frozen is None:
+            self._frozen = freeze(self.copy())
+        return self._frozen
+
+class Journal():
+    """Append-only log of the keyed changes made to a json file since its
+       last snapshot. Each line is [keys, value], or [keys] for a deletion.
+
+       The records a compaction clears are kept in .journal.prev, they turn
+       the previous snapshot, kept as .bak, into the current one. That's
+       how a corrupted snapshot is rebuilt"""
+    def __init__(self, filename, compact_every=1000):
+        self.path = os.path.splitext(filename)[0]+'.journal'
+        self.prev_path = self.path + '.prev'
+        self.compact_every = compact_every
+        self.records = 0
+        self.size = 0  # Bytes, where the next record starts
+        self.dropped = 0  # Bytes cleared so far, marks are absolute
+        self.logger = logging.getLogger("simbad")
+        self._file = None
+
+    def append(self, keys, value=None, delete=False):
+        if delete:
+            record = [keys]
+        else:
+            record = [keys, value]
+        line = (json.dumps(record, separators=(',',':')) + "\n").encode('utf-8')
+        if self._file is None:
+            self._file = open(self.path, mode="ab")
+        self._file.write(line)
+        self._file.flush()
+        self.records += 1
+        self.size += len(line)
+
+    def replay(self, data):
+        """Applies the logged changes to the snapshot's data. A torn last
+           record (crash mid-write) is dropped from the journal"""
+        good = 0
+        self.records = 0
+        self.size = 0
+        try:
+            f = open(self.path, mode="rb")
+        except FileNotFoundError:
+            return data
+        with f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Incomplete record")
+                    record = json.loads(line.decode('utf-8'))
+                    self._apply(data, *record)
+                except (ValueError, TypeError, IndexError, KeyError):
+                    self.logger.warning("{} has a corrupted record at byte {}."
+                        " Discarding it and what follows.".format(
+                            self.path, good))
+                    break
+                good += len(line)
+                self.records += 1
+        if good < os.path.getsize(self.path):
+            self.close()
+            os.truncate(self.path, good)
+        self.size = good
+        return data
+
+    def mark(self):
+        """Position of the next record, for clear()"""
+        return self.dropped + self.size
+
+    def clear(self, upto=None):
+        """Called once the snapshot holds the changes logged before mark
+           `upto`, every change if not given. Later ones are kept"""
+        self.close()
+        cut = self.size
+        if upto is not None:
+            cut = max(0, min(upto - self.dropped, self.size))
+        head = tail = b""
+        if self.size:
+            with open(self.path, mode="rb") as f:
+                head = f.read(cut)
+                tail = f.read()
+        # What the previous snapshot needs to become this one
+        tmp_file = self.prev_path + ".tmp"
+        with open(tmp_file, mode="wb") as f:
+            f.write(head)
+        os.replace(tmp_file, self.prev_path)
+        if tail:
+            tmp_file = self.path + ".tmp"
+            with open(tmp_file, mode="wb") as f:
+                f.write(tail)
+            os.replace(tmp_file, self.path)
+        elif os.path.isfile(self.path):
+            os.truncate(self.path, 0)
+        self.records = tail.count(b"\n")
+        self.size = len(tail)
+        self.dropped += cut
+
+    def replay_previous(self, data):
+        """Applies the records the last compaction cleared, to the previous
+           snapshot's data. Stops at a corrupted record"""
+        try:
+            f = open(self.prev_path, mode="rb")
+        except FileNotFoundError:
+            return data
+        with f:
+            for line in f:
+                try:
+                    self._apply(data, *json.loads(line.decode('utf-8')))
+                except (ValueError, TypeError, IndexError, KeyError):
+                    self.logger.warning("{} has a corrupted record, the "
+                                        "rest is ignored.".format(
+                                            self.prev_path))
+                    break
+        return data
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _apply(self, data, keys, *value):
+        if not keys:
+            raise ValueError("Empty key path")
+        for key in keys[:-1]:
+            data = data.setdefault(key, {})
+        if value:
+            data[keys[-1]] = value[0]
+        else:
+            data.pop(keys[-1], None)
+
 class DataIO():
     def __init__(self):
         self.logger = logging.getLogger("simbad")
+        self.loop = None
+        self.flush_delay = 2
+        self._dirty = {}  # filename : data waiting to be written
+        self._timers = {}  # filename : scheduled flush
+        self._thread = None
+        self._lock = threading.RLock()
+        self._journals = {}  # filename : Journal
+        self._cache = {}  # filename : ParsedFile
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._executor = None
+        self._seq = itertools.count()  # Orders saves, newest wins
+        self._written = {}  # filename : seq of the data on disk
+        self._writes = {}  # filename : last queued async save
+        self._inflight = {}  # filename : (seq, marshal blob, journal mark)
+        self._formats = {}  # filename : format, "pretty" if not set
+
+    def enable_write_behind(self, loop, delay=2):
+        """From now on save_json only marks the data as dirty. Bursts of
+           saves to the same file are written once, `delay` seconds after
+           the first one"""
+        self.loop = loop
+        self.flush_delay = delay
+        self._thread = threading.get_ident()
 
     def save_json(self, filename, data):
         """Saves and backups json file"""
-        bak_file = os.path.splitext(filename)[0]+'.bak'
-        self._save_json(filename, data)
-        copy(filename, bak_file) # Backup copy
+        if not self._write_behind():
+            with self._lock:
+                self._dirty.pop(filename, None)
+                self._write(filename, data)
+            return
+        self._dirty[filename] = data
+        if filename not in self._timers:
+            self._timers[filename] = self.loop.call_later(
+                self.flush_delay, self._flush_later, filename)
 
-    def load_json(self, filename):
-        """Loads json file and restores backup copy in case of corrupted file"""
+    async def save_json_async(self, filename, data, durable=False):
+        """Saves json file from a worker thread, the event loop only takes
+           a snapshot of data. Saves to the same file land in the order
+           they were made. With durable=True it also waits for the fsync"""
+        self._cancel_flush(filename) # This save supersedes a pending one
+        self._dirty.pop(filename, None)
+        seq = next(self._seq)
+        # Snapshot, data can change while queued. Encoding it is left to
+        # the worker, marshal only copies and is much quicker
         try:
-            return self._read_json(filename)
-        except json.decoder.JSONDecodeError:
-            result = self._restore_json(filename)
-            if result:
-                return self._read_json(filename) # Which hopefully will work
-            else:
-                raise CorruptedJSON("{} is corrupted and no backup copy is"
-                                    " available.".format(filename))
+            blob = marshal.dumps(data)
+        except ValueError: # Like a defaultdict, keep what json would
+            blob = marshal.dumps(plain(data))
+        mark = None
+        if filename in self._journals:
+            mark = self._journals[filename].mark()
+        pending = (seq, blob, mark)
+        self._inflight[filename] = pending
+        loop = asyncio.get_event_loop()
+        previous = self._writes.get(filename)
+        done = asyncio.Future(loop=loop)
+        self._writes[filename] = done
+        job = None
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            job = loop.run_in_executor(self._get_executor(), self._write_blob,
+                                       filename, pending, durable)
+            job.add_done_callback(
+                lambda j: self._write_done(filename, done, pending))
+            # Being cancelled mustn't let the next save overtake this one
+            await asyncio.shield(job)
+        finally:
+            if job is None:
+                self._write_done(filename, done, pending)
+
+    async def sync_json(self, filename):
+        """Waits until every save of filename made so far is on disk and
+           fsynced"""
+        if filename in self._dirty:
+            await self.save_json_async(filename, self._dirty[filename],
+                                       durable=True)
+            return
+        previous = self._writes.get(filename)
+        if previous is not None:
+            await asyncio.wait([previous])
+        if os.path.isfile(filename):
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(self._get_executor(), self._fsync,
+                                       filename)
+
+    def set_format(self, filename, fmt):
+        """How filename is written: "pretty" json for files meant to be
+           read and edited by people, "compact" json or "binary" for big,
+           often saved data. Loading detects the format on its own, an
+           existing file in another format is converted right away.
+           "binary" keeps only what json would: dict subclasses, tuples
+           and non string keys are saved as json would save them"""
+        if fmt not in FORMATS:
+            raise ValueError("Unknown format {}".format(fmt))
+        self._formats[filename] = fmt
+        if filename in self._dirty or filename in self._inflight:
+            return # Will be written in the new format anyway
+        if self._file_format(filename) not in (None, fmt):
+            with self._lock:
+                self._write(filename, self.load_json(filename))
+                self.logger.info("Converted {} to {}".format(filename, fmt))
+
+    def use_journal(self, filename, compact_every=1000):
+        """Persists filename as a snapshot plus a journal of the changes
+           saved with update_json. The journal is compacted back into the
+           snapshot every `compact_every` changes"""
+        if filename not in self._journals:
+            journal = self._journals[filename] = Journal(filename,
+                                                         compact_every)
+            if os.path.isfile(journal.prev_path):
+                return
+            # A .bak from before the journal can be older than the
+            # snapshot, with no records to bring it up to date
+            try:
+                self._parse(filename)
+            except (OSError, ValueError, CorruptedJSON):
+                return
+            self._keep_snapshot(filename)
+
+    def update_json(self, filename, data, *keys):
+        """Saves a change to data[keys[0]][keys[1]]... A missing key is
+           saved as a deletion. Only the changed value is written if
+           filename has a journal, the whole file otherwise"""
+        journal = self._journals.get(filename)
+        if journal is None or not keys:
+            return self.save_json(filename, data)
+        value = data
+        deleted = False
+        for key in keys:
+            if key not in value:
+                value, deleted = None, True
+                break
+            value = value[key]
+        with self._lock:
+            journal.append(list(keys), value, delete=deleted)
+        if journal.records >= journal.compact_every:
+            self.save_json(filename, data)
+
+    def flush(self, filename=None):
+        """Writes pending saves to disk. Every file if no filename is given"""
+        if filename is None:
+            files = list(self._dirty)
+            # Queued async saves too, the loop might not run them anymore
+            for f, pending in list(self._inflight.items()):
+                try:
+                    self._write_blob(f, pending)
+                except Exception:
+                    self.logger.exception("Couldn't flush {}".format(f))
+        else:
+            files = [filename]
+        for f in files:
+            self._cancel_flush(f)
+            with self._lock:
+                if f not in self._dirty:
+                    continue
+                data = self._dirty.pop(f)
+                try:
+                    self._write(f, data)
+                except OSError:
+                    self.logger.exception("Couldn't flush {}".format(f))
+                    if self._write_behind(): # Try again later
+                        self.save_json(f, data)
+                except Exception: # Can't be saved, trying again won't help
+                    self.logger.exception("Couldn't flush {}, the save is "
+                                          "dropped".format(f))
+
+    def load_json(self, filename, frozen=False):
+        """Loads json file and restores backup copy in case of corrupted file.
+           With frozen=True a shared read-only view is returned instead of
+           a copy. Journaled files are always copied"""
+        if filename in self._dirty:
+            self.flush(filename)
+        if filename in self._inflight and filename not in self._journals:
+            # Newer than what's on disk. Journaled files don't need this,
+            # their journal is only cleared after the snapshot landed
+            data = plain(marshal.loads(self._inflight[filename][1]))
+            return freeze(data) if frozen else data
+        if filename in self._journals:
+            # A save compacting the journal in between would leave us
+            # the old snapshot with the cleared journal
+            with self._lock:
+                parsed = self._parse_or_restore(filename)
+                return self._journals[filename].replay(parsed.copy())
+        parsed = self._parse_or_restore(filename)
+        if frozen:
+            return parsed.frozen()
+        return parsed.copy()
 
     def is_valid_json(self, filename):
         """Returns True if readable json file, False if not existing.
            Tries to restore backup copy if corrupted"""
+        if filename in self._dirty:
+            self.flush(filename)
+        if filename in self._inflight:
+            return True
         try:
-            data = self._read_json(filename)
+            self._parse(filename)
         except FileNotFoundError:
             return False
-        except json.decoder.JSONDecodeError:
+        except (json.decoder.JSONDecodeError, CorruptedJSON):
             result = self._restore_json(filename)
             return result # If False, no backup copy, might as well
         else:             # allow the overwrite
             return True
 
+    def cache_stats(self):
+        return {"hits": self.cache_hits, "misses": self.cache_misses,
+                "files": len(self._cache)}
+
+    def _parse_or_restore(self, filename):
+        try:
+            return self._parse(filename)
+        except (json.decoder.JSONDecodeError, CorruptedJSON):
+            result = self._restore_json(filename)
+            if result:
+                return self._parse(filename) # Which hopefully will work
+            else:
+                raise CorruptedJSON("{} is corrupted and no backup copy is"
+                                    " available.".format(filename))
+
+    def _parse(self, filename):
+        """Parses filename, unless it didn't change since the last time"""
+        st = os.stat(filename)
+        key = (st.st_mtime_ns, st.st_size)
+        parsed = self._cache.get(filename)
+        if parsed is not None and parsed.key == key:
+            self.cache_hits += 1
+            return parsed
+        self.cache_misses += 1
+        parsed = ParsedFile(key, self._read_json(filename))
+        self._cache[filename] = parsed
+        return parsed
+
+    def _write_behind(self):
+        if self.loop is None or self.loop.is_closed():
+            return False
+        # Other threads can't schedule on the loop safely
+        return threading.get_ident() == self._thread
+
+    def _flush_later(self, filename):
+        """Write-behind timer, the actual writing is done off the loop"""
+        self._timers.pop(filename, None)
+        if filename in self._dirty:
+            self.loop.create_task(self._flush_async(filename))
+
+    async def _flush_async(self, filename):
+        data = self._dirty.get(filename)
+        if data is None: # Flushed since the timer fired
+            return
+        try:
+            await self.save_json_async(filename, data)
+        except OSError:
+            self.logger.exception("Couldn't flush {}".format(filename))
+            if filename not in self._dirty: # Try again later
+                self.save_json(filename, data)
+        except Exception: # Can't be saved, trying again won't help
+            self.logger.exception("Couldn't flush {}, the save is "
+                                  "dropped".format(filename))
+
+    def _cancel_flush(self, filename):
+        timer = self._timers.pop(filename, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=2)
+        return self._executor
+
+    def _write_done(self, filename, done, pending):
+        if not done.done():
+            done.set_result(None)
+        if self._writes.get(filename) is done:
+            del self._writes[filename]
+        if self._inflight.get(filename) is pending:
+            del self._inflight[filename]
+
+    def _write_blob(self, filename, pending, durable=False):
+        """Runs on a worker thread, encoding included"""
+        seq, blob, mark = pending
+        with self._lock:
+            if self._written.get(filename, -1) >= seq and not durable:
+                return # Don't bother encoding, newer data landed
+        raw = self._encode(filename, marshal.loads(blob))
+        self._write(filename, None, seq, durable, mark, raw)
+
+    def _write(self, filename, data, seq=None, durable=False, mark=None,
+               raw=None):
+        """Writes data, or raw if it's already encoded, unless the same or
+           newer data already landed. `mark` is the journal's mark when data
+           was snapshotted"""
+        with self._lock:
+            if seq is None:
+                seq = next(self._seq)
+            if self._written.get(filename, -1) >= seq:
+                if durable:
+                    self._fsync(filename)
+                return
+            self._cache.pop(filename, None)
+            journal = self._journals.get(filename)
+            if journal is not None:
+                # No copy, the old snapshot is kept as the backup and the
+                # journal records what it lacks
+                self._keep_snapshot(filename)
+            self._save_json(filename, data, durable, raw)
+            self._written[filename] = seq
+            if journal is not None:
+                # The snapshot now has these changes, the journal can go
+                journal.clear(mark)
+            else:
+                bak_file = os.path.splitext(filename)[0]+'.bak'
+                copy(filename, bak_file) # Backup copy
+
+    def _keep_snapshot(self, filename):
+        """Links the snapshot as the .bak, copies it where the filesystem
+           has no hard links. Done before the snapshot is replaced"""
+        if not os.path.isfile(filename):
+            return
+        bak_file = os.path.splitext(filename)[0]+'.bak'
+        tmp_file = bak_file + ".tmp"
+        try:
+            os.remove(tmp_file)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(filename, tmp_file)
+        except OSError:
+            copy(filename, tmp_file)
+        os.replace(tmp_file, bak_file)
+
     def _read_json(self, filename):
-        with open(filename, encoding='utf-8', mode="r") as f:
-            data = json.load(f)
-        return data
+        with open(filename, mode="rb") as f:
+            raw = f.read()
+        return self._decode(filename, raw)
+
+    def _decode(self, filename, raw):
+        if raw.startswith(BINARY_PREFIX):
+            return self._decode_binary(filename, raw)
+        return json.loads(raw.decode('utf-8'))
 
-    def _save_json(self, filename, data):
-        with open(filename, encoding='utf-8', mode="w") as f:
-            json.dump(data, f, indent=4,sort_keys=True,
+    def _encode(self, filename, data):
+        fmt = self._formats.get(filename, "pretty")
+        if fmt == "binary":
+            # Other types would need find_class to load, see PlainUnpickler
+            payload = pickle.dumps(plain(data), protocol=PICKLE_PROTOCOL)
+            return BINARY_HEADER.pack(BINARY_MAGIC, len(payload),
+                                      zlib.crc32(payload)) + payload
+        elif fmt == "compact":
+            text = json.dumps(data, separators=(',',':'))
+        else:
+            text = json.dumps(data, indent=4,sort_keys=True,
                 separators=(',',' : '))
+        return text.encode('utf-8')
+
+    def _decode_binary(self, filename, raw):
+        size = BINARY_HEADER.size
+        if len(raw) < size:
+            raise CorruptedJSON("{} has a truncated header".format(filename))
+        magic, length, crc = BINARY_HEADER.unpack_from(raw)
+        payload = raw[size:]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            raise CorruptedJSON("{} failed its checksum".format(filename))
+        try:
+            if magic == BINARY_MAGIC:
+                return PlainUnpickler(io.BytesIO(payload)).load()
+            elif magic == BINARY_MARSHAL:
+                return marshal.loads(payload)
+        except (EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            pass
+        raise CorruptedJSON("{} can't be decoded".format(filename))
+
+    def _file_format(self, filename):
+        """Format of the file on disk, None if there's no file or
+           it can't be told"""
+        try:
+            with open(filename, mode="rb") as f:
+                head = f.read(len(BINARY_MAGIC))
+        except FileNotFoundError:
+            return None
+        if head == BINARY_MARSHAL:
+            return "marshal" # Rewritten by set_format
+        elif head.startswith(BINARY_PREFIX):
+            return "binary"
+        elif len(head) <= 2:
+            return None # Empty containers look the same either way
+        elif head[1:2] == b"\n":
+            return "pretty"
+        return "compact"
+
+    def _save_json(self, filename, data, durable=False, raw=None):
+        tmp_file = filename + ".tmp"
+        if raw is None:
+            raw = self._encode(filename, data)
+        with open(tmp_file, mode="wb") as f:
+            f.write(raw)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, filename) # Never leaves a half written file
+        if durable:
+            self._fsync_dir(filename)
         return data
 
+    def _fsync(self, filename):
+        with self._lock:
+            with open(filename, mode="rb") as f:
+                os.fsync(f.fileno())
+            self._fsync_dir(filename)
+
+    def _fsync_dir(self, filename):
+        """Makes the rename durable. Not possible on every OS"""
+        try:
+            fd = os.open(os.path.dirname(filename) or ".", os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
     def _restore_json(self, filename):
         bak_file = os.path.splitext(filename)[0]+'.bak'
-        if os.path.isfile(bak_file):
+        journal = self._journals.get(filename)
+        if journal is not None and os.path.isfile(bak_file):
+            # The previous snapshot plus what the last compaction cleared.
+            # The journal then applies to it like to the lost snapshot
+            with self._lock:
+                self._cache.pop(filename, None)
+                try:
+                    data = self._read_json(bak_file)
+                except (ValueError, CorruptedJSON):
+                    self.logger.critical("{} and its backup copy are "
+                            "corrupted.".format(filename))
+                    return False
+                self._save_json(filename, journal.replay_previous(data))
+            self.logger.warning("{} was corrupted. Rebuilt it from the "
+                    "backup copy and the journal.".format(filename))
+            return True
+        elif os.path.isfile(bak_file):
+            self._cache.pop(filename, None)
             copy(bak_file, filename) # Restore last working copy
             self.logger.warning("{} was corrupted. Restored "
                     "backup copy.".format(filename))
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from .dataIO import dataIO
+
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Upper bounds, seconds
+COGS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UTILS_DIR = os.path.join(COGS_DIR, "utils") + os.sep
+BOT_DIR = os.path.dirname(COGS_DIR) + os.sep
+COGS_DIR += os.sep
+
+
+class LagMonitor():
+    """Measures how late the event loop runs its callbacks.
+
+    A heartbeat task sleeps `interval` seconds at a time and records every
+    wake-up that came more than `threshold` seconds late. Meanwhile a
+    watchdog thread looks at the loop thread's stack whenever the heartbeat
+    is overdue, so the stall is blamed on the cog code that was running."""
+
+    def __init__(self, threshold=0.1, interval=0.05, history=5000):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = deque(maxlen=history)  # (time, lag, culprit, where)
+        self.beats = 0
+        self.started = None
+        self.logger = logging.getLogger("simbad")
+        self.loop = None
+        self._loop_thread = None
+        self._last_beat = 0
+        self._sample = None  # (beat, culprit, where) of the ongoing stall
+        self._running = False
+        self._tasks = []
+
+    def start(self, loop, dump_path=None, dump_every=300):
+        """Must be called from the loop's thread"""
+        if self._running:
+            return
+        self.loop = loop
+        self.started = time.time()
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._running = True
+        self._tasks.append(loop.create_task(self._heartbeat()))
+        if dump_path is not None:
+            self._tasks.append(loop.create_task(
+                self._dumper(dump_path, dump_every)))
+        watchdog = threading.Thread(target=self._watchdog,
+                                    name="lag watchdog", daemon=True)
+        watchdog.start()
+
+    def stop(self):
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def histogram(self):
+        """[(upper bound, stalls)], the last bound is None for longer ones"""
+        counts = [0] * (len(BUCKETS) + 1)
+        for _, lag, _, _ in self.stalls:
+            for i, bound in enumerate(BUCKETS):
+                if lag <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return list(zip(BUCKETS + (None,), counts))
+
+    def offenders(self, top=10):
+        """[(culprit, stalls, total lag, worst lag, where)], worst first"""
+        stats = {}
+        for _, lag, culprit, where in self.stalls:
+            entry = stats.get(culprit)
+            if entry is None:
+                stats[culprit] = [culprit, 1, lag, lag, where]
+                continue
+            entry[1] += 1
+            entry[2] += lag
+            if lag > entry[3]:
+                entry[3], entry[4] = lag, where
+        ranked = sorted(stats.values(), key=lambda e: e[2], reverse=True)
+        return [tuple(e) for e in ranked[:top]]
+
+    def report(self):
+        return {"threshold": self.threshold,
+                "started": self.started,
+                "beats": self.beats,
+                "histogram": [[b, c] for b, c in self.histogram()],
+                "offenders": [list(o) for o in self.offenders(25)],
+                "recent": [list(s) for s in list(self.stalls)[-50:]]}
+
+    async def _heartbeat(self):
+        while self._running:
+            expected = self.loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = self.loop.time() - expected
+            sample = self._sample
+            beat = self.beats
+            self.beats += 1
+            self._last_beat = time.monotonic()
+            if lag < self.threshold:
+                continue
+            if sample is not None and sample[0] == beat:
+                culprit, where = sample[1], sample[2]
+            else: # Too short for the watchdog to catch it
+                culprit, where = "unknown", ""
+            self.stalls.append((time.time(), lag, culprit, where))
+            self.logger.warning("Event loop stalled for {:.3f}s in {} ({})"
+                                "".format(lag, culprit, where))
+
+    async def _dumper(self, path, every):
+        dumped = None
+        while self._running:
+            await asyncio.sleep(every)
+            last = self.stalls[-1] if self.stalls else None
+            if last is dumped:
+                continue
+            try:
+                await dataIO.save_json_async(path, self.report())
+            except Exception:
+                self.logger.exception("Couldn't save the lag report")
+            else:
+                dumped = last
+
+    def _watchdog(self):
+        while self._running and not self.loop.is_closed():
+            time.sleep(self.threshold / 4)
+            overdue = time.monotonic() - self._last_beat
+            if overdue < self.interval + self.threshold:
+                continue
+            beat = self.beats
+            if self._sample is not None and self._sample[0] == beat:
+                continue # Already know who's stalling this beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._sample = (beat,) + self._blame(frame)
+
+    def _blame(self, frame):
+        """Returns (culprit, where) for a stack. The culprit is the
+           outermost function of a cog, which is the command or listener
+           that was called, falling back to cogs/utils then Simbad.py"""
+        innermost = frame
+        cog = util = main = None
+        while frame is not None:
+            path = os.path.abspath(frame.f_code.co_filename)
+            if path.startswith(UTILS_DIR):
+                util = frame
+            elif path.startswith(COGS_DIR):
+                cog = frame
+            elif path.startswith(BOT_DIR):
+                main = frame
+            frame = frame.f_back
+        culprit = cog or util or main or innermost
+        code = innermost.f_code
+        where = "{}:{} {}".format(os.path.basename(code.co_filename),
+                                  innermost.f_lineno, code.co_name)
+        return self._name(culprit), where
+
+    def _name(self, frame):
+        module = os.path.splitext(os.path.basename(frame.f_code.co_filename))
+        return "{}.{}".format(module[0], frame.f_code.co_name)
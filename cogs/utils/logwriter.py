@@ -0,0 +1,239 @@
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+_STOP = object()
+
+
+class _Handle():
+    __slots__ = ("path", "file", "size", "period", "synced")
+
+    def __init__(self, path, file, size, period):
+        self.path = path
+        self.file = file
+        self.size = size
+        self.period = period
+        self.synced = True
+
+
+class LogWriter():
+    """Appends text to many log files without blocking the event loop.
+
+    write() only queues the text. A writer thread takes it in batches,
+    grouped per file, and appends it through an LRU pool of at most
+    `max_open` open files. A file's text is written once `flush_size`
+    bytes are waiting or after `flush_every` seconds, written files are
+    fsynced every `fsync_every` seconds.
+
+    A file is rotated when it would grow past `max_size` bytes or when a
+    new `max_age` seconds period starts (a day by default, in UTC). The
+    rotated segment is renamed to <name>.<time> and gzipped by another
+    thread.
+
+    Subclasses can write something else than text by overriding _encode,
+    and follow what is written through the _appended, _rotating and
+    _closing hooks, which run on the writer thread"""
+
+    def __init__(self, max_open=64, flush_size=65536, flush_every=1,
+                 fsync_every=30, max_size=50 * 1024 * 1024, max_age=86400,
+                 compress=True):
+        self.max_open = max_open
+        self.flush_size = flush_size
+        self.flush_every = flush_every
+        self.fsync_every = fsync_every
+        self.max_size = max_size
+        self.max_age = max_age
+        self.compress = compress
+        self.logger = logging.getLogger("simbad")
+        self.written = 0
+        self.rotated = 0
+        self._queue = queue.Queue()
+        self._handles = OrderedDict()  # path : _Handle, least recent first
+        self._pending = {}  # path : [bytes]
+        self._pending_size = {}  # path : bytes waiting
+        self._thread = None
+        self._compressor = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="log writer",
+                                        daemon=True)
+        self._thread.start()
+
+    def write(self, path, item):
+        """Queues item, text unless _encode was overridden"""
+        self._queue.put_nowait((path, item))
+
+    def close(self, timeout=10):
+        """Writes what's queued, closes the files and stops the thread"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        if self._compressor is not None:
+            self._compressor.shutdown(wait=True)
+            self._compressor = None
+
+    # Writer thread
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_every
+        next_fsync = time.monotonic() + self.fsync_every
+        while True:
+            wait = max(0, min(next_flush, next_fsync) - time.monotonic())
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                item = None
+            stop = False
+            while item is not None:
+                if item is _STOP:
+                    stop = True
+                    break
+                try:
+                    self._add(*item)
+                except Exception: # Drop it, the thread must keep going
+                    self.logger.exception("Log writer dropped a record")
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            now = time.monotonic()
+            try:
+                if stop or now >= next_flush:
+                    self._flush(list(self._pending))
+                    next_flush = now + self.flush_every
+                if stop or now >= next_fsync:
+                    self._fsync()
+                    next_fsync = now + self.fsync_every
+            except Exception:
+                self.logger.exception("Log writer error")
+            if stop:
+                self._close_all()
+                return
+
+    def _encode(self, item):
+        return item.encode("utf-8", "backslashreplace")
+
+    def _appended(self, handle, offset, chunks):
+        """chunks were written to handle's file starting at offset"""
+        pass
+
+    def _rotating(self, path, rotated):
+        """path is about to be renamed to rotated, and then compressed"""
+        pass
+
+    def _closing(self, handle):
+        pass
+
+    def _add(self, path, item):
+        data = self._encode(item)
+        pending = self._pending.get(path)
+        if pending is None:
+            pending = self._pending[path] = []
+            self._pending_size[path] = 0
+        pending.append(data)
+        self._pending_size[path] += len(data)
+        if self._pending_size[path] >= self.flush_size:
+            self._flush((path,))
+
+    def _flush(self, paths):
+        for path in paths:
+            chunks = self._pending.pop(path, None)
+            size = self._pending_size.pop(path, 0)
+            if not chunks:
+                continue
+            try:
+                self._append(path, chunks, size)
+            except OSError:
+                self.logger.exception("Couldn't write to {}".format(path))
+
+    def _append(self, path, chunks, size):
+        handle = self._open(path)
+        if (handle.size and handle.size + size > self.max_size or
+                handle.period != self._period()):
+            handle = self._rotate(path)
+        handle.file.write(b"".join(chunks))
+        handle.file.flush() # To the OS, fsynced later
+        self._appended(handle, handle.size, chunks)
+        handle.size += size
+        handle.synced = False
+        self.written += size
+
+    def _fsync(self):
+        for handle in self._handles.values():
+            if not handle.synced:
+                os.fsync(handle.file.fileno())
+                handle.synced = True
+
+    def _period(self, when=None):
+        return int((time.time() if when is None else when) // self.max_age)
+
+    def _open(self, path):
+        handle = self._handles.get(path)
+        if handle is not None:
+            self._handles.move_to_end(path)
+            return handle
+        while len(self._handles) >= self.max_open:
+            _, old = self._handles.popitem(last=False)
+            self._close(old)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            period = self._period()
+        else: # Last written to in that period
+            period = self._period(st.st_mtime)
+        f = open(path, "ab")
+        handle = self._handles[path] = _Handle(path, f, f.tell(), period)
+        return handle
+
+    def _rotate(self, path):
+        self._close(self._handles.pop(path))
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        rotated = "{}.{}".format(path, stamp)
+        n = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+            rotated = "{}.{}-{}".format(path, stamp, n)
+            n += 1
+        self._rotating(path, rotated)
+        os.replace(path, rotated)
+        self.rotated += 1
+        if self.compress:
+            if self._compressor is None:
+                self._compressor = ThreadPoolExecutor(max_workers=1)
+            self._compressor.submit(self._gzip, rotated)
+        return self._open(path)
+
+    def _gzip(self, path):
+        try:
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+        except OSError:
+            self.logger.exception("Couldn't compress {}".format(path))
+
+    def _close(self, handle):
+        try:
+            self._closing(handle)
+            if not handle.synced:
+                handle.file.flush()
+                os.fsync(handle.file.fileno())
+        finally:
+            handle.file.close()
+
+    def _close_all(self):
+        while self._handles:
+            _, handle = self._handles.popitem(last=False)
+            try:
+                self._close(handle)
+            except OSError:
+                self.logger.exception("Couldn't close a log file")
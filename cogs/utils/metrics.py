@@ -0,0 +1,194 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+
+
+def log_linear_bounds(lowest=0.0001, highest=60, per_doubling=2):
+    """HDR-style histogram bounds, in seconds. Every doubling of the
+       latency is split in `per_doubling` even steps, so the relative
+       error is the same for fast and slow commands"""
+    bounds = []
+    base = lowest
+    while base < highest:
+        step = base / per_doubling
+        for i in range(1, per_doubling + 1):
+            bounds.append(round(base + step * i, 6))
+        base *= 2
+    return tuple(bounds)
+
+
+class CommandStats():
+    __slots__ = ("count", "errors", "total", "buckets")
+
+    def __init__(self, buckets):
+        self.count = 0
+        self.errors = {}  # error type : count
+        self.total = 0.0
+        self.buckets = [0] * buckets  # The last one is +Inf
+
+
+class Metrics():
+    """Invocations, errors and latency of the commands, per command
+       qualified name and per server.
+
+    Everything is updated from the event loop's thread only, so the
+    counters are plain ints. Exported in the Prometheus text format to a
+    file and, if a port is given, on http://127.0.0.1:<port>/metrics"""
+
+    def __init__(self, bounds=None):
+        self.bounds = bounds or log_linear_bounds()
+        self.commands = {}  # (qualified name, server id) : CommandStats
+        self.started = time.time()
+        self.logger = logging.getLogger("simbad")
+        self._running = {}  # ctx : perf_counter when it started
+        self._tasks = []
+        self._server = None
+
+    # Hooks
+
+    def attach(self, bot):
+        """Times the commands bot runs. Client.dispatch calls the
+           handle_<event> methods right away instead of scheduling them
+           like the on_<event> listeners, so these run just before and
+           just after process_commands awaits Command.invoke"""
+        bot.handle_command = self.command_started
+        bot.handle_command_completion = self.command_completed
+        bot.handle_command_error = self.command_failed
+
+    def command_started(self, command, ctx):
+        if len(self._running) > 10000: # Contexts that never finished
+            self._running.clear()
+        self._running[ctx] = time.perf_counter()
+
+    def command_completed(self, command, ctx):
+        self._record(ctx, None)
+
+    def command_failed(self, error, ctx):
+        if ctx.command is None: # CommandNotFound
+            return
+        self._record(ctx, type(error).__name__)
+
+    def _record(self, ctx, error):
+        start = self._running.pop(ctx, None)
+        server = ctx.message.server
+        key = (ctx.command.qualified_name,
+               server.id if server is not None else "private")
+        stats = self.commands.get(key)
+        if stats is None:
+            stats = self.commands[key] = CommandStats(len(self.bounds) + 1)
+        stats.count += 1
+        if error is not None:
+            stats.errors[error] = stats.errors.get(error, 0) + 1
+        if start is not None:
+            took = time.perf_counter() - start
+            stats.total += took
+            stats.buckets[bisect.bisect_left(self.bounds, took)] += 1
+
+    # Export
+
+    def prometheus(self):
+        """Prometheus text exposition format, version 0.0.4"""
+        invocations = ["# HELP simbad_command_invocations_total Commands "
+                       "invoked.",
+                       "# TYPE simbad_command_invocations_total counter"]
+        errors = ["# HELP simbad_command_errors_total Commands that raised "
+                  "an error, by error type.",
+                  "# TYPE simbad_command_errors_total counter"]
+        latency = ["# HELP simbad_command_latency_seconds Time from the "
+                   "command starting to it finishing.",
+                   "# TYPE simbad_command_latency_seconds histogram"]
+        bounds = [repr(b) for b in self.bounds] + ["+Inf"]
+        for (name, server), stats in sorted(self.commands.items()):
+            labels = 'command="{}",server="{}"'.format(_escape(name), server)
+            invocations.append("simbad_command_invocations_total{{{}}} {}"
+                               "".format(labels, stats.count))
+            for error, count in sorted(stats.errors.items()):
+                errors.append('simbad_command_errors_total{{{},error="{}"}} '
+                              '{}'.format(labels, error, count))
+            cumulative = 0
+            for bound, count in zip(bounds, stats.buckets):
+                cumulative += count
+                latency.append('simbad_command_latency_seconds_bucket{{{},'
+                               'le="{}"}} {}'.format(labels, bound,
+                                                     cumulative))
+            latency.append("simbad_command_latency_seconds_sum{{{}}} {!r}"
+                           "".format(labels, stats.total))
+            latency.append("simbad_command_latency_seconds_count{{{}}} {}"
+                           "".format(labels, cumulative))
+        uptime = ["# HELP simbad_start_time_seconds When the bot started.",
+                  "# TYPE simbad_start_time_seconds gauge",
+                  "simbad_start_time_seconds {!r}".format(self.started)]
+        return "\n".join(invocations + errors + latency + uptime) + "\n"
+
+    def start(self, loop, path=None, every=60, port=None):
+        """Writes the metrics to `path` every `every` seconds and serves
+           them on 127.0.0.1:`port`. Both are optional"""
+        if path is not None:
+            self._tasks.append(loop.create_task(
+                self._exporter(loop, path, every)))
+        if port is not None:
+            self._tasks.append(loop.create_task(self._listen(port)))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    async def _exporter(self, loop, path, every):
+        while True:
+            await asyncio.sleep(every)
+            text = self.prometheus()
+            try:
+                await loop.run_in_executor(None, _write_file, path, text)
+            except OSError:
+                self.logger.exception("Couldn't export the metrics")
+
+    async def _listen(self, port):
+        try:
+            self._server = await asyncio.start_server(
+                self._serve, "127.0.0.1", port)
+        except OSError:
+            self.logger.exception("Couldn't serve the metrics on port "
+                                  "{}".format(port))
+        else:
+            self.logger.info("Serving metrics on http://127.0.0.1:{}/metrics"
+                             "".format(port))
+
+    async def _serve(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while True: # Headers, not needed
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            if request.split(b" ")[:1] == [b"GET"]:
+                body = self.prometheus().encode("utf-8")
+                head = ("HTTP/1.0 200 OK\r\nContent-Type: text/plain; "
+                        "version=0.0.4\r\n")
+            else:
+                body = b""
+                head = "HTTP/1.0 405 Method Not Allowed\r\n"
+            head += "Content-Length: {}\r\n\r\n".format(len(body))
+            writer.write(head.encode("ascii") + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n",
+                                                                   "\\n")
+
+
+def _write_file(path, text):
+    tmp_file = path + ".tmp"
+    with open(tmp_file, encoding="utf-8", mode="w") as f:
+        f.write(text)
+    os.replace(tmp_file, path)
@@ -0,0 +1,128 @@
+import logging
+from collections import namedtuple
+
+
+class Route(namedtuple("Route", "message prefix command allowed own "
+                       "channel_id server_id private")):
+    """A message parsed once for every listener.
+
+    prefix is the command prefix the message starts with, None if there's
+    none. command is the first word after it, as typed. allowed is
+    user_allowed's answer and own is True for the bot's own messages"""
+    __slots__ = ()
+
+
+class MessageRouter():
+    """Hands each message only to the listeners interested in it.
+
+    Listeners are coroutine functions taking a Route. They can ask for
+    the messages of a channel, of a server, the ones invoking a command
+    word (optionally on a single server) or, with no interest given,
+    every message. Each call runs as its own task like discord.py's own
+    listeners, errors are logged"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.logger = logging.getLogger("simbad")
+        self._global = []
+        self._channels = {}  # channel id : [listener]
+        self._servers = {}  # server id : [listener]
+        self._commands = {}  # (server id or None, lowercase word) : [listener]
+
+    def route(self, message, allowed=True):
+        content = message.content
+        prefix = command = None
+        for p in self.bot.command_prefix:
+            if content.startswith(p):
+                prefix = p
+                command = content[len(p):].split(" ", 1)[0]
+                break
+        private = message.channel.is_private
+        return Route(message, prefix, command, allowed,
+                     message.author.id == self.bot.user.id,
+                     message.channel.id,
+                     None if private else message.server.id, private)
+
+    def dispatch(self, route):
+        listeners = self._global
+        extra = []
+        by_channel = self._channels.get(route.channel_id)
+        if by_channel:
+            extra += by_channel
+        if route.server_id is not None:
+            by_server = self._servers.get(route.server_id)
+            if by_server:
+                extra += by_server
+        if route.command:
+            word = route.command.lower()
+            by_command = self._commands.get((None, word))
+            if by_command:
+                extra += by_command
+            if route.server_id is not None:
+                by_command = self._commands.get((route.server_id, word))
+                if by_command:
+                    extra += by_command
+        if extra:
+            listeners = listeners + extra
+            if len(extra) > 1 or self._global: # Called once at most
+                seen = set()
+                listeners = [l for l in listeners
+                             if not (l in seen or seen.add(l))]
+        for listener in listeners:
+            self.bot.loop.create_task(self._run(listener, route))
+
+    def listen(self, listener, channel=None, server=None, command=None):
+        """Sends listener the messages of channel, of server, or invoking
+           command, which can be combined with server. Every message if
+           none is given"""
+        table, key = self._where(channel, server, command)
+        if table is None:
+            bucket = self._global
+        else:
+            bucket = table.setdefault(key, [])
+        if listener not in bucket:
+            bucket.append(listener)
+
+    def unlisten(self, listener, channel=None, server=None, command=None):
+        table, key = self._where(channel, server, command)
+        bucket = self._global if table is None else table.get(key, ())
+        if listener in bucket:
+            bucket.remove(listener)
+            if table is not None and not bucket:
+                del table[key]
+
+    def unlisten_all(self, listener):
+        """Removes every interest of listener"""
+        self._filter(lambda l: l != listener)
+
+    def remove_module(self, module):
+        """Removes the listeners defined in module, for cog unloading"""
+        self._filter(lambda l: getattr(l, "__module__", None) != module)
+
+    def _where(self, channel, server, command):
+        if command is not None:
+            return self._commands, (server, command.lower())
+        elif channel is not None:
+            return self._channels, channel
+        elif server is not None:
+            return self._servers, server
+        return None, None
+
+    def _filter(self, keep):
+        self._global[:] = [l for l in self._global if keep(l)]
+        for table in (self._channels, self._servers, self._commands):
+            for bucket in table.values():
+                bucket[:] = [l for l in bucket if keep(l)]
+        self._prune()
+
+    def _prune(self):
+        for table in (self._channels, self._servers, self._commands):
+            for key in [k for k, bucket in table.items() if not bucket]:
+                del table[key]
+
+    async def _run(self, listener, route):
+        try:
+            await listener(route)
+        except Exception:
+            self.logger.exception("Error in message listener {}".format(
+                getattr(listener, "__qualname__", listener)))
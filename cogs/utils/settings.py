@@ -1,12 +1,34 @@
 from .dataIO import fileIO
+from collections import namedtuple
+from contextlib import contextmanager
+from copy import deepcopy
 import discord
 import os
 
 default_path = "data/simbad/settings.json"
 
+class ServerView(namedtuple("ServerView", "admin mod recruiter admin_ids "
+                            "staff_ids recruiter_ids exempt_ids")):
+    """Read-only role settings of a server with the role names resolved to
+       role ids. The *_ids fields match names case insensitively, like the
+       command checks. exempt_ids are the admin and mod roles matched by
+       exact name, which skip the blacklist"""
+    __slots__ = ()
+
+    @staticmethod
+    def has_any_role(member, role_ids):
+        """True if member has one of role_ids, a set of role ids"""
+        if not role_ids:
+            return False
+        return not role_ids.isdisjoint(r.id for r in
+                                       getattr(member, "roles", ()))
+
 class Settings:
     def __init__(self,path=default_path):
         self.path = path
+        self._views = {}  # server id : ServerView
+        self._batch_depth = 0
+        self._batch_dirty = False
         self.check_folders()
         self.default_settings = {"EMAIL" : "EmailHere", "PASSWORD" : "", "OWNER" : "id_here", "PREFIXES" : [], "default":{"ADMIN_ROLE" : "Transistor", "MOD_ROLE" : "Process"}, "LOGIN_TYPE" : "email"}
         if not fileIO(self.path,"check"):
@@ -32,8 +54,32 @@ class Settings:
                 os.makedirs(folder)
 
     def save_settings(self):
+        self._views.clear() # Role settings might have changed
+        if self._batch_depth:
+            self._batch_dirty = True
+            return
         fileIO(self.path,"save",self.bot_settings)
 
+    @contextmanager
+    def batch(self):
+        """Changes made inside the block are saved once, when the
+           outermost batch ends. If the block raises they're undone"""
+        snapshot = deepcopy(self.bot_settings)
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.bot_settings = snapshot
+            self._views.clear()
+            if self._batch_depth == 1:
+                self._batch_dirty = False # Nothing left to save
+            raise
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch_dirty:
+                self._batch_dirty = False
+                self.save_settings()
+
     def update_old_settings(self):
         mod = self.bot_settings["MOD_ROLE"]
         admin = self.bot_settings["ADMIN_ROLE"]
@@ -113,7 +159,7 @@ class Settings:
 
     @default_recruiter.setter
     def default_recruiter(self, value):
-        if "default" not in self.bot.settings:
+        if "default" not in self.bot_settings:
             self.update_old_settings()
         self.bot_settings["default"]["RECRUITER_ROLE"] = value
         self.save_settings()
@@ -153,10 +199,11 @@ class Settings:
         if server is None:
             return
         assert isinstance(server,discord.Server)
-        if server.id not in self.bot_settings:
-            self.add_server(server.id)
-        self.bot_settings[server.id]["ADMIN_ROLE"] = value
-        self.save_settings()
+        with self.batch():
+            if server.id not in self.bot_settings:
+                self.add_server(server.id)
+            self.bot_settings[server.id]["ADMIN_ROLE"] = value
+            self.save_settings()
 
     def get_server_mod(self,server):
         if server is None:
@@ -170,10 +217,11 @@ class Settings:
         if server is None:
             return
         assert isinstance(server,discord.Server)
-        if server.id not in self.bot_settings:
-            self.add_server(server.id)
-        self.bot_settings[server.id]["MOD_ROLE"] = value
-        self.save_settings()
+        with self.batch():
+            if server.id not in self.bot_settings:
+                self.add_server(server.id)
+            self.bot_settings[server.id]["MOD_ROLE"] = value
+            self.save_settings()
 
     def get_server_recruiter(self,server):
         if server is None:
@@ -187,10 +235,36 @@ class Settings:
         if server is None:
             return
         assert isinstance(server,discord.Server)
-        if server.id not in self.bot_settings:
-            self.add_server(server.id)
-        self.bot_settings[server.id]["RECRUITER_ROLE"] = value
-        self.save_settings()
+        with self.batch():
+            if server.id not in self.bot_settings:
+                self.add_server(server.id)
+            self.bot_settings[server.id]["RECRUITER_ROLE"] = value
+            self.save_settings()
+
+    def server_view(self, server):
+        """Precomputed ServerView, rebuilt only after the settings or the
+           server's roles changed"""
+        sid = server.id if server is not None else None
+        view = self._views.get(sid)
+        if view is None:
+            view = self._views[sid] = self._build_view(server)
+        return view
+
+    def invalidate_server(self, server):
+        """Call when the server's roles were created, renamed or deleted"""
+        self._views.pop(server.id if server is not None else None, None)
+
+    def _build_view(self, server):
+        admin = self.get_server_admin(server)
+        mod = self.get_server_mod(server)
+        recruiter = self.get_server_recruiter(server)
+        roles = server.roles if server is not None else ()
+        def ids(*names):
+            names = {n.lower() for n in names}
+            return frozenset(r.id for r in roles if r.name.lower() in names)
+        exempt = frozenset(r.id for r in roles if r.name in (admin, mod))
+        return ServerView(admin, mod, recruiter, ids(admin),
+                          ids(admin, mod, recruiter), ids(recruiter), exempt)
 
     def add_server(self,sid):
         self.bot_settings[sid] = self.bot_settings["default"].copy()
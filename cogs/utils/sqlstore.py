@@ -0,0 +1,179 @@
+import json
+import sqlite3
+import logging
+from .dataIO import dataIO
+
+LEGACY = ""  # Server id of pre-multiserver accounts
+
+
+class KeyedStore():
+    """Per-server/per-user data kept in a SQLite table, one row per user.
+
+    Reads and writes only touch the requested row. The fields named in
+    `indexes` get their own indexed column so they can be queried (e.g.
+    a leaderboard) without loading every row."""
+
+    def __init__(self, path, table, indexes=()):
+        self.path = path
+        self.table = table
+        self.indexes = tuple(indexes)
+        self.logger = logging.getLogger("simbad")
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_table()
+        columns = ", ".join(("server", "user", "data") + self.indexes)
+        marks = ", ".join("?" * (3 + len(self.indexes)))
+        self._set_sql = "INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+            table, columns, marks)
+
+    def _create_table(self):
+        columns = "".join(", {}".format(i) for i in self.indexes)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS {} (server TEXT NOT NULL,"
+                          " user TEXT NOT NULL, data TEXT NOT NULL{},"
+                          " PRIMARY KEY (server, user))".format(
+                              self.table, columns))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta "
+                          "(key TEXT PRIMARY KEY, value TEXT)")
+        for index in self.indexes:
+            self.conn.execute("CREATE INDEX IF NOT EXISTS {0}_{1} ON "
+                              "{0} (server, {1})".format(self.table, index))
+
+    def get(self, server_id, user_id):
+        """Returns a fresh copy of the user's data, None if there's none"""
+        row = self.conn.execute("SELECT data FROM {} WHERE server = ? AND "
+                                "user = ?".format(self.table),
+                                (server_id, user_id)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, server_id, user_id, value):
+        self.conn.execute(self._set_sql, self._row(server_id, user_id, value))
+
+    def delete(self, server_id, user_id):
+        self.conn.execute("DELETE FROM {} WHERE server = ? AND user = ?"
+                          "".format(self.table), (server_id, user_id))
+
+    def delete_server(self, server_id):
+        self.conn.execute("DELETE FROM {} WHERE server = ?".format(
+            self.table), (server_id,))
+
+    def exists(self, server_id, user_id):
+        row = self.conn.execute("SELECT 1 FROM {} WHERE server = ? AND "
+                                "user = ?".format(self.table),
+                                (server_id, user_id)).fetchone()
+        return row is not None
+
+    def servers(self):
+        rows = self.conn.execute("SELECT DISTINCT server FROM {} WHERE "
+                                 "server != ?".format(self.table), (LEGACY,))
+        return [r[0] for r in rows]
+
+    def server_items(self, server_id):
+        """Yields (user_id, data) for every user of the server"""
+        rows = self.conn.execute("SELECT user, data FROM {} WHERE server = ?"
+                                 "".format(self.table), (server_id,))
+        for user_id, data in rows:
+            yield user_id, json.loads(data)
+
+    def top(self, index, server_id=None, limit=10, reverse=True,
+            per_user=False, servers=None):
+        """Returns [(server_id, user_id, data)] sorted by an indexed field.
+           per_user keeps only the best row of users found on many servers.
+           Without a server_id, `servers` restricts the ranking to those
+           server ids"""
+        if index not in self.indexes:
+            raise ValueError("{} is not an indexed field".format(index))
+        if server_id is None:
+            where, key = "server != ?", LEGACY
+            if servers is not None:
+                # A temp table, there can be more servers than SQLite
+                # allows parameters in a query
+                self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS scope "
+                                  "(server TEXT PRIMARY KEY)")
+                with self.conn:
+                    self.conn.execute("BEGIN")
+                    self.conn.execute("DELETE FROM scope")
+                    self.conn.executemany("INSERT OR IGNORE INTO scope "
+                                          "VALUES (?)",
+                                          ((s,) for s in servers))
+                where += " AND server IN (SELECT server FROM scope)"
+        else:
+            where, key = "server = ?", server_id
+        best = "MAX" if reverse else "MIN"
+        order = "DESC" if reverse else "ASC"
+        if per_user:
+            # SQLite takes the other columns from the MAX/MIN row
+            sql = ("SELECT server, user, data, {0}({1}) AS best FROM {2} "
+                   "WHERE {3} GROUP BY user ORDER BY best {4} LIMIT ?")
+        else:
+            sql = ("SELECT server, user, data FROM {2} WHERE {3} "
+                   "ORDER BY {1} {4} LIMIT ?")
+        rows = self.conn.execute(sql.format(best, index, self.table, where,
+                                            order), (key, limit))
+        return [(r[0], r[1], json.loads(r[2])) for r in rows]
+
+    def migrate_json(self, filename):
+        """One-shot import of an old {server: {user: data}} json file.
+           Accounts from the legacy single-server format are kept under
+           the LEGACY server id"""
+        done = self.conn.execute("SELECT value FROM meta WHERE key = ?",
+                                 ("migrated:" + filename,)).fetchone()
+        if done is not None or not dataIO.is_valid_json(filename):
+            return False
+        data = dataIO.load_json(filename)
+        self.save_json(data)
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                          ("migrated:" + filename, "1"))
+        self.logger.info("Migrated {} to {}".format(filename, self.path))
+        return True
+
+    # dataIO-like interface, for code that still wants the whole thing
+
+    def load_json(self):
+        data = {}
+        rows = self.conn.execute("SELECT server, user, data FROM {}".format(
+            self.table))
+        for server_id, user_id, value in rows:
+            if server_id == LEGACY:
+                data[user_id] = json.loads(value)
+            else:
+                data.setdefault(server_id, {})[user_id] = json.loads(value)
+        return data
+
+    def save_json(self, data):
+        rows = []
+        for server_id, users in data.items():
+            if not self._is_server(users):
+                rows.append(self._row(LEGACY, server_id, users))
+                continue
+            for user_id, value in users.items():
+                rows.append(self._row(server_id, user_id, value))
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM {}".format(self.table))
+            self.conn.executemany(self._set_sql, rows)
+
+    def is_valid_json(self):
+        try:
+            self.conn.execute("SELECT 1 FROM {} LIMIT 1".format(self.table))
+        except sqlite3.DatabaseError:
+            return False
+        return True
+
+    def close(self):
+        self.conn.close()
+
+    def _is_server(self, users):
+        return isinstance(users, dict) and \
+            all(isinstance(v, (dict, list)) for v in users.values())
+
+    def _row(self, server_id, user_id, value):
+        row = [server_id, user_id, json.dumps(value)]
+        for index in self.indexes:
+            try:
+                row.append(value.get(index))
+            except AttributeError:
+                row.append(None)
+        return row
@@ -0,0 +1,220 @@
+import unicodedata
+from collections import deque
+
+# Letters from other scripts that look like latin ones (a subset of
+# Unicode's confusables.txt), for normalize(confusables=True)
+CONFUSABLES = {
+    # Cyrillic
+    "а": "a", "в": "b", "е": "e", "ё": "e", "һ": "h", "і": "i", "ї": "i",
+    "ј": "j", "к": "k", "м": "m", "н": "h", "о": "o", "р": "p", "с": "c",
+    "т": "t", "у": "y", "х": "x", "ѕ": "s", "ԁ": "d", "ԛ": "q", "ԝ": "w",
+    "ь": "b", "ѵ": "v", "ӏ": "l",
+    # Greek
+    "α": "a", "β": "b", "ε": "e", "η": "n", "ι": "i", "κ": "k", "ν": "v",
+    "ο": "o", "ρ": "p", "τ": "t", "υ": "u", "χ": "x", "ω": "w", "ϲ": "c",
+    # Latin lookalikes
+    "ı": "i", "ł": "l", "ø": "o", "đ": "d", "ħ": "h", "ŧ": "t",
+    "ɑ": "a", "ɡ": "g", "ɩ": "i", "ʀ": "r", "ʏ": "y",
+}
+# Zero width characters used to split words, and combining marks left
+# over by NFKD (accents)
+_STRIP = dict.fromkeys(
+    [0x200B, 0x200C, 0x200D, 0x2060, 0xFEFF, 0x00AD] +
+    list(range(0x0300, 0x0370)) + list(range(0x1AB0, 0x1B00)) +
+    list(range(0x1DC0, 0x1E00)) + list(range(0x20D0, 0x2100)) +
+    list(range(0xFE20, 0xFE30)))
+_CONFUSABLES = str.maketrans(CONFUSABLES)
+
+
+class WordFilter():
+    """Finds which of many words occur in a text in one pass over it.
+
+    The words are compiled into an Aho-Corasick automaton, so a scan costs
+    the same with ten words or ten thousand. Adding a word only inserts its
+    missing states and patches the failure links that now lead to them.
+    Removing one only unmarks its end state, the automaton is rebuilt once
+    more words were removed than are left.
+
+    Text and words are case folded. With confusables=True accents,
+    compatibility forms (fullwidth, math letters...), zero width
+    characters and lookalike letters from other scripts are normalized
+    away too."""
+
+    def __init__(self, words=(), casefold=True, confusables=False):
+        self.casefold = casefold
+        self.confusables = confusables
+        self._words = {}  # normalized : as added
+        self._counts = {}  # normalized : words added that fold to it
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [None]  # Word ending here or at a failure state
+        self._end = [None]  # Word ending here
+        self._kids = {}  # state : states failing to it
+        self._removed = 0  # Words unmarked since the last compile
+        for word in words: # Compiled at once on the first search
+            key = self.normalize(word)
+            if key:
+                self._words.setdefault(key, word)
+                self._counts[key] = self._counts.get(key, 0) + 1
+        self._stale = bool(self._words)
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, word):
+        return self.normalize(word) in self._words
+
+    def add(self, word):
+        """Words folding to one already added share its entry, it's
+           only removed once all of them were"""
+        key = self.normalize(word)
+        if not key:
+            return
+        self._counts[key] = self._counts.get(key, 0) + 1
+        if key not in self._words:
+            self._words[key] = word
+            if not self._stale:
+                self._insert(key)
+
+    def remove(self, word):
+        key = self.normalize(word)
+        if key not in self._words:
+            return
+        self._counts[key] -= 1
+        if self._counts[key] > 0:
+            return
+        del self._counts[key]
+        del self._words[key]
+        if self._stale:
+            return
+        state = 0
+        for char in key:
+            state = self._goto[state][char]
+        self._end[state] = None
+        self._refresh_out(state)
+        self._removed += 1
+        if self._removed > len(self._words):
+            self._stale = True # Mostly dead states, start over
+
+    def normalize(self, text):
+        if self.confusables:
+            text = unicodedata.normalize("NFKD", text).translate(_STRIP)
+        text = text.casefold() if self.casefold else text
+        if self.confusables:
+            text = text.translate(_CONFUSABLES)
+        return text
+
+    def search(self, text):
+        """Returns the first word found in text, as added, or None"""
+        if self._stale:
+            self._compile()
+        if not self._words:
+            return None
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for char in self.normalize(text):
+            while True:
+                nxt = goto[state].get(char)
+                if nxt is not None:
+                    state = nxt
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            if out[state] is not None:
+                return self._words[out[state]]
+        return None
+
+    def _insert(self, word):
+        goto = self._goto
+        state = 0
+        for char in word:
+            nxt = goto[state].get(char)
+            if nxt is None:
+                nxt = self._new_state(state, char)
+            state = nxt
+        self._end[state] = word
+        self._refresh_out(state)
+
+    def _new_state(self, parent, char):
+        goto, fail = self._goto, self._fail
+        state = len(goto)
+        goto[parent][char] = state
+        goto.append({})
+        fail.append(0)
+        self._out.append(None)
+        self._end.append(None)
+        f = fail[parent]
+        while parent and f and char not in goto[f]:
+            f = fail[f]
+        if parent:
+            fail[state] = goto[f].get(char, 0)
+        self._kids.setdefault(fail[state], set()).add(state)
+        # States reaching parent through their failure links, and with no
+        # char transition of their own on the way, now fail to the new one
+        redirected = []
+        todo = [parent]
+        while todo:
+            for kid in self._kids.get(todo.pop(), ()):
+                nxt = goto[kid].get(char)
+                if nxt is None:
+                    todo.append(kid)
+                elif nxt != state:
+                    redirected.append(nxt)
+        for nxt in redirected:
+            self._kids[fail[nxt]].discard(nxt)
+            fail[nxt] = state
+            self._kids.setdefault(state, set()).add(nxt)
+        self._refresh_out(state)
+        for nxt in redirected:
+            self._refresh_out(nxt)
+        return state
+
+    def _refresh_out(self, state):
+        """Recomputes the output of state and of the states failing to it,
+           down to where nothing changes"""
+        out, end, fail = self._out, self._end, self._fail
+        todo = [state]
+        while todo:
+            s = todo.pop()
+            new = end[s]
+            if new is None and s:
+                new = out[fail[s]]
+            if new != out[s] or s == state:
+                out[s] = new
+                todo.extend(self._kids.get(s, ()))
+
+    def _compile(self):
+        goto, fail, out, end = [{}], [0], [None], [None]
+        for word in self._words:
+            state = 0
+            for char in word:
+                nxt = goto[state].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][char] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    out.append(None)
+                    end.append(None)
+                state = nxt
+            out[state] = end[state] = word
+        kids = {}
+        queue = deque(goto[0].values())
+        for state in queue:
+            kids.setdefault(0, set()).add(state)
+        while queue:
+            state = queue.popleft()
+            for char, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and char not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(char, 0)
+                kids.setdefault(fail[nxt], set()).add(nxt)
+                if out[nxt] is None: # A shorter word ending here
+                    out[nxt] = out[fail[nxt]]
+        self._goto, self._fail, self._out, self._end = goto, fail, out, end
+        self._kids = kids
+        self._removed = 0
+        self._stale = False